@@ -0,0 +1,8 @@
+'''
+    Reusable analysis components for periscope measurement data.
+
+    functions - constant-memory streaming aggregators for unis.measurements
+    subscribe - callback and async iterator access to new measurement values
+    ecdf      - sliding window empirical CDF over bulk-parsed measurement files
+    series    - memory-mapped binary (int64 ts, float64 value) series files
+'''
@@ -0,0 +1,132 @@
+import numpy as np
+'''
+    Streaming empirical CDF over a sliding window of measurements.
+
+    StreamingECDF keeps the last @window values both in arrival order (a ring buffer) and in sorted
+    order. New values are taken in bulk; the sorted copy is updated by removing the evicted values and
+    inserting the new ones rather than re-sorting, and a CDF is emitted every @step values.
+    read_text parses "ts value" text files in large chunks with NumPy. Plotting is a separate,
+    optional stage, see render.
+
+        ecdf = StreamingECDF(window=1000, step=100)
+        for ts, values in read_text("measurements.txt"):
+            for x, y in ecdf.update(values):
+                ...
+'''
+
+class StreamingECDF:
+    '''
+        param: window - number of most recent values the CDF is computed over.
+        param: step - emit a CDF every @step values (default: every @window values).
+    '''
+    def __init__(self, window=100, step=None):
+        self.window     = window
+        self.step       = step or window
+        self.ring       = np.empty(window, dtype=np.float64)
+        self.sorted     = np.empty(0, dtype=np.float64)
+        self.pos        = 0
+        self.count      = 0
+        self.pending    = 0
+
+        return
+
+    def update(self, values):
+        '''
+            Add @values (any 1-d array-like) to the window.
+            returns - list of (x, y) CDF arrays, one for every @step boundary crossed.
+        '''
+        values = np.asarray(values, dtype=np.float64).ravel()
+        emitted = []
+        i = 0
+        while i < len(values):
+            take = min(self.step - self.pending, len(values) - i)
+            self._add(values[i:i + take])
+            self.pending += take
+            i += take
+            if self.pending == self.step:
+                emitted.append(self.cdf())
+                self.pending = 0
+        return emitted
+
+    def cdf(self):
+        '''
+            The CDF of the current window as (sorted values, cumulative fraction) arrays.
+        '''
+        n = len(self.sorted)
+        return self.sorted.copy(), np.arange(1, n + 1, dtype=np.float64) / n
+
+    def _add(self, chunk):
+        n = len(chunk)
+        if n >= self.window:
+            self.ring[:] = chunk[-self.window:]
+            self.pos, self.count = 0, self.window
+            self.sorted = np.sort(self.ring)
+            return
+
+        # until the ring is full the slots after pos are empty, so only the last slots written evict
+        idx = (self.pos + np.arange(n)) % self.window
+        evicted = self.ring[idx[n - max(0, self.count + n - self.window):]]
+        self.ring[idx] = chunk
+        self.pos = (self.pos + n) % self.window
+        self.count = min(self.count + n, self.window)
+
+        if n > self.window // 8:
+            self.sorted = np.sort(self.ring[:self.count] if self.count < self.window else self.ring)
+            return
+
+        if len(evicted):
+            evicted = np.sort(evicted)
+            # equal values are removed from consecutive slots
+            nth = np.arange(len(evicted)) - np.searchsorted(evicted, evicted, side='left')
+            self.sorted = np.delete(self.sorted, np.searchsorted(self.sorted, evicted, side='left') + nth)
+
+        chunk = np.sort(chunk)
+        self.sorted = np.insert(self.sorted, np.searchsorted(self.sorted, chunk), chunk)
+
+def read_text(path, chunk_bytes=1 << 24):
+    '''
+        Reads a whitespace separated "ts value" file in chunks of about @chunk_bytes.
+        yields - (ts int64 array, value float64 array) per chunk.
+    '''
+    with open(path, "rb") as f:
+        rest = b""
+        while True:
+            block = f.read(chunk_bytes)
+            if not block:
+                break
+            block = rest + block
+            cut = block.rfind(b"\n") + 1
+            if cut == 0:
+                rest = block
+                continue
+            rest = block[cut:]
+            yield _parse(block[:cut])
+        if rest.strip():
+            yield _parse(rest)
+
+def _parse(text):
+    flat = np.fromstring(text.decode("ascii"), sep=" ")
+    pairs = flat[:len(flat) - len(flat) % 2].reshape(-1, 2)
+    return pairs[:, 0].astype(np.int64), pairs[:, 1]
+
+def render(cdfs, prefix="ecdf_", start=0, title="CDF as a function of Data"):
+    '''
+        Optional rendering stage: writes one PNG per (x, y) CDF in @cdfs as <prefix><n>.png, numbered from @start.
+        Requires matplotlib.
+        returns - the next unused number.
+    '''
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    i = start
+    for x, y in cdfs:
+        plt.plot(x, y, label="ecdf", marker="<", markerfacecolor='none')
+        plt.legend()
+        plt.title(title)
+        plt.xlabel("data")
+        plt.ylabel("cdf")
+        plt.savefig(prefix + str(i) + ".png")
+        plt.close()
+        i += 1
+    return i
@@ -0,0 +1,223 @@
+import math
+from collections import deque
+
+from unis.measurements import Function
+'''
+    Constant-memory streaming aggregators for unis measurement data.
+
+    Each class here is a unis.measurements.Function and is attached to a metadata's data the same way
+    as the built-in ones:
+
+        md.data.attachFunction(EWMA(alpha=0.2), 'ewma')
+        md.data.attachFunction(Quantile(0.99), 'p99')
+        print(md.data.ewma, md.data.p99)
+
+    Every update is O(1) (amortized for the sliding min/max) or bounded by a fixed bucket count, and
+    every aggregator keeps a fixed amount of state no matter how long the stream runs.
+'''
+
+class EWMA(Function):
+    '''
+        Exponentially weighted moving average.
+
+        param: alpha - weight of the newest value, in (0, 1].
+        param: halflife - alternatively, the number of values after which a value's weight has halved.
+    '''
+    def __init__(self, alpha=None, halflife=None):
+        super(EWMA, self).__init__()
+        if alpha is None:
+            alpha = 1 - 0.5 ** (1.0 / halflife) if halflife else 0.1
+        self.alpha = alpha
+        self.value = None
+
+    def apply(self, value, ts):
+        if self.value is None:
+            self.value = float(value)
+        else:
+            self.value += self.alpha * (value - self.value)
+        return self.value
+
+class WindowedMean(Function):
+    '''
+        Mean over the last @size values, kept in a ring buffer with running sums.
+        The sums are recomputed from the buffer once per @size updates to stop floating point drift.
+    '''
+    def __init__(self, size=100):
+        super(WindowedMean, self).__init__()
+        self.size   = size
+        self.ring   = [0.0] * size
+        self.pos    = 0
+        self.count  = 0
+        self.total  = 0.0
+        self.sq     = 0.0
+
+    def apply(self, value, ts):
+        value = float(value)
+        old = self.ring[self.pos]
+        if self.count == self.size:
+            self.total -= old
+            self.sq    -= old * old
+        else:
+            self.count += 1
+
+        self.ring[self.pos] = value
+        self.total += value
+        self.sq    += value * value
+        self.pos = (self.pos + 1) % self.size
+
+        if self.pos == 0:
+            window = self.ring[:self.count]
+            self.total = math.fsum(window)
+            self.sq    = math.fsum(v * v for v in window)
+        return self.count
+
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def variance(self):
+        '''
+            Sample variance of the window, or None for fewer than two values.
+        '''
+        if self.count < 2:
+            return None
+        mean = self.total / self.count
+        return max(self.sq - self.count * mean * mean, 0.0) / (self.count - 1)
+
+    def postprocess(self, value):
+        return self.mean()
+
+class WindowedVariance(WindowedMean):
+    '''
+        Sample variance over the last @size values, see WindowedMean.
+    '''
+    def postprocess(self, value):
+        return self.variance()
+
+class _SlidingExtreme(Function):
+    def __init__(self, size=100, span=None):
+        super(_SlidingExtreme, self).__init__()
+        self.size   = size
+        self.span   = span
+        self.seq    = 0
+        self.window = deque()
+
+    def apply(self, value, ts):
+        '''
+            Keeps a monotonic deque of (seq, ts, value); each value is pushed and popped at most once.
+        '''
+        while self.window and not self._keeps(self.window[-1][2], value):
+            self.window.pop()
+        self.window.append((self.seq, ts, value))
+        self.seq += 1
+
+        while self.window[0][0] <= self.seq - 1 - self.size or \
+              (self.span is not None and ts is not None and self.window[0][1] < ts - self.span):
+            self.window.popleft()
+        return self.window[0][2]
+
+class SlidingMin(_SlidingExtreme):
+    '''
+        Minimum of the last @size values, and optionally only of those within @span of the newest ts.
+    '''
+    def _keeps(self, older, newer):
+        return older < newer
+
+class SlidingMax(_SlidingExtreme):
+    '''
+        Maximum of the last @size values, and optionally only of those within @span of the newest ts.
+    '''
+    def _keeps(self, older, newer):
+        return older > newer
+
+class _DenseStore:
+    '''
+        Bucket counts for a contiguous range of sketch indexes. When the range would exceed
+        @max_buckets the lowest buckets are merged, so accuracy is only lost at the low end.
+    '''
+    def __init__(self, max_buckets):
+        self.max_buckets    = max_buckets
+        self.counts         = []
+        self.offset         = 0
+        self.total          = 0
+
+    def add(self, index):
+        if not self.counts:
+            self.counts, self.offset = [0], index
+        elif index < self.offset:
+            grow = self.offset - index
+            if len(self.counts) + grow > self.max_buckets:
+                index = self.offset
+            else:
+                self.counts[0:0] = [0] * grow
+                self.offset = index
+        elif index >= self.offset + len(self.counts):
+            length = index - self.offset + 1
+            if length > self.max_buckets:
+                shift = length - self.max_buckets
+                merged = sum(self.counts[:shift + 1])
+                self.counts = [merged] + self.counts[shift + 1:]
+                self.offset += shift
+            self.counts.extend([0] * (index - self.offset + 1 - len(self.counts)))
+
+        self.counts[index - self.offset] += 1
+        self.total += 1
+
+class Quantile(Function):
+    '''
+        DDSketch quantile estimate with relative accuracy @accuracy.
+
+        param: q - a quantile in [0, 1], or a list of them; the function then yields a list.
+        param: accuracy - relative accuracy guarantee of the returned values.
+        param: max_buckets - bucket limit per sign, bounding memory regardless of stream length.
+    '''
+    def __init__(self, q=0.5, accuracy=0.01, max_buckets=2048):
+        super(Quantile, self).__init__()
+        self.q          = q
+        self.gamma      = (1 + accuracy) / (1 - accuracy)
+        self.log_gamma  = math.log(self.gamma)
+        self.positive   = _DenseStore(max_buckets)
+        self.negative   = _DenseStore(max_buckets)
+        self.zero       = 0
+        self.count      = 0
+
+    def apply(self, value, ts):
+        if value > 0:
+            self.positive.add(self._index(value))
+        elif value < 0:
+            self.negative.add(self._index(-value))
+        else:
+            self.zero += 1
+        self.count += 1
+        return self.count
+
+    def quantile(self, q):
+        if self.count == 0:
+            return None
+
+        rank = q * (self.count - 1)
+        seen = 0
+        neg = self.negative
+        for i in range(len(neg.counts) - 1, -1, -1):
+            seen += neg.counts[i]
+            if seen > rank:
+                return -self._value(i + neg.offset)
+        seen += self.zero
+        if seen > rank:
+            return 0.0
+        pos = self.positive
+        for i, c in enumerate(pos.counts):
+            seen += c
+            if seen > rank:
+                return self._value(i + pos.offset)
+        return self._value(pos.offset + len(pos.counts) - 1)
+
+    def postprocess(self, value):
+        if isinstance(self.q, (list, tuple)):
+            return [self.quantile(q) for q in self.q]
+        return self.quantile(self.q)
+
+    def _index(self, value):
+        return int(math.ceil(math.log(value) / self.log_gamma))
+
+    def _value(self, index):
+        return 2 * self.gamma ** index / (self.gamma + 1)
@@ -0,0 +1,179 @@
+import argparse
+import os
+import struct
+
+import numpy as np
+'''
+    Compact on-disk format for measurement series.
+
+    A series file is a 64 byte header, followed by fixed-width records of an int64 timestamp and a
+    float64 value in non-decreasing timestamp order, followed by a chunk index holding the first
+    timestamp of every @chunk_records records. SeriesReader maps the records with numpy.memmap, so a
+    time window is found with a binary search over the index and one chunk, and returned as a view
+    without reading or parsing the rest of the file.
+
+        with SeriesWriter("owdelay.series") as w:
+            w.append(ts, values)
+
+        window = SeriesReader("owdelay.series").slice(start, end)
+        window['ts'], window['value']
+'''
+
+MAGIC   = b"PSSERIES"
+VERSION = 1
+RECORD  = np.dtype([('ts', '<i8'), ('value', '<f8')])
+HEADER  = struct.Struct("<8sIIQQQ")
+HEADER_SIZE = 64
+
+class SeriesWriter:
+    '''
+        Writes a series file at @path. Records must be appended in non-decreasing timestamp order.
+    '''
+    def __init__(self, path, chunk_records=65536):
+        self.path           = path
+        self.chunk_records  = chunk_records
+        self.count          = 0
+        self.last_ts        = None
+        self.index          = []
+        self._file          = open(path, "wb")
+        self._file.write(b"\0" * HEADER_SIZE)
+
+        return
+
+    def append(self, ts, values):
+        '''
+            Append records from timestamp and value arrays of equal length.
+        '''
+        ts      = np.asarray(ts, dtype='<i8')
+        values  = np.asarray(values, dtype='<f8')
+        if len(ts) != len(values):
+            raise ValueError("ts and values must have the same length")
+        if len(ts) == 0:
+            return
+        if (self.last_ts is not None and ts[0] < self.last_ts) or np.any(ts[1:] < ts[:-1]):
+            raise ValueError("series records must be in timestamp order")
+
+        first = -self.count % self.chunk_records
+        self.index.extend(ts[first::self.chunk_records].tolist())
+
+        records = np.empty(len(ts), dtype=RECORD)
+        records['ts'], records['value'] = ts, values
+        self._file.write(records.tobytes())
+        self.count  += len(ts)
+        self.last_ts = int(ts[-1])
+
+    def close(self):
+        if self._file.closed:
+            return
+        index_offset = HEADER_SIZE + self.count * RECORD.itemsize
+        self._file.write(np.asarray(self.index, dtype='<i8').tobytes())
+        self._file.seek(0)
+        self._file.write(HEADER.pack(MAGIC, VERSION, RECORD.itemsize, self.count, self.chunk_records, index_offset))
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class SeriesReader:
+    '''
+        Zero-copy reader for a series file. @records is a numpy.memmap of the whole series.
+    '''
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            magic, version, size, count, chunk_records, index_offset = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or size != RECORD.itemsize:
+            raise ValueError("%s is not a series file" % path)
+        if version != VERSION:
+            raise ValueError("unsupported series version %s" % version)
+
+        self.path           = path
+        self.count          = count
+        self.chunk_records  = chunk_records
+        self.records        = np.memmap(path, dtype=RECORD, mode='r', offset=HEADER_SIZE, shape=(count,)) \
+                              if count else np.empty(0, dtype=RECORD)
+        chunks              = -(-count // chunk_records)
+        self.index          = np.memmap(path, dtype='<i8', mode='r', offset=index_offset, shape=(chunks,)) \
+                              if chunks else np.empty(0, dtype='<i8')
+
+        return
+
+    def __len__(self):
+        return self.count
+
+    def position(self, ts, side='left'):
+        '''
+            The record position of @ts as numpy.searchsorted would return it, looking at one chunk only.
+        '''
+        if self.count == 0:
+            return 0
+        chunk = max(int(np.searchsorted(self.index, ts, side=side)) - 1, 0)
+        lo = chunk * self.chunk_records
+        hi = min(lo + self.chunk_records, self.count)
+        return lo + int(np.searchsorted(self.records['ts'][lo:hi], ts, side=side))
+
+    def slice(self, start=None, end=None):
+        '''
+            Records with @start <= ts < @end as a view into the mapped file. Either bound may be None.
+        '''
+        lo = 0 if start is None else self.position(start)
+        hi = self.count if end is None else self.position(end)
+        return self.records[lo:hi]
+
+    def chunks(self, start=None, end=None, size=None):
+        '''
+            yields - (ts, value) arrays for consecutive pieces of [@start, @end), the same shape read_text yields.
+        '''
+        window = self.slice(start, end)
+        size = size or self.chunk_records
+        for i in range(0, len(window), size):
+            piece = window[i:i + size]
+            yield piece['ts'], piece['value']
+
+def from_text(src, dst, chunk_records=65536):
+    '''
+        Converts a whitespace separated "ts value" text file to a series file.
+    '''
+    from analysis.ecdf import read_text
+
+    with SeriesWriter(dst, chunk_records=chunk_records) as writer:
+        for ts, values in read_text(src):
+            writer.append(ts, values)
+
+def from_cbor(src, dst, chunk_records=65536, batch=65536):
+    '''
+        Converts a CBOR sequence to a series file. Each CBOR item may be a [ts, value] pair, a
+        {"ts": ..., "value": ...} map, or a list of either. Requires cbor2.
+    '''
+    import cbor2
+
+    ts, values = [], []
+    with open(src, "rb") as f, SeriesWriter(dst, chunk_records=chunk_records) as writer:
+        decoder = cbor2.CBORDecoder(f)
+        end = os.fstat(f.fileno()).st_size
+        while f.tell() < end:
+            item = decoder.decode()
+            points = item if isinstance(item, list) and item and isinstance(item[0], (list, dict)) else [item]
+            for p in points:
+                if isinstance(p, dict):
+                    ts.append(p['ts'])
+                    values.append(p.get('value', p.get('val')))
+                else:
+                    ts.append(p[0])
+                    values.append(p[1])
+            if len(ts) >= batch:
+                writer.append(ts, values)
+                ts, values = [], []
+        writer.append(ts, values)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Convert "ts value" text or CBOR measurement files to the series format')
+    parser.add_argument('src', type=str, help="Input file, read as CBOR if it ends in .cbor")
+    parser.add_argument('dst', type=str, help="Output series file")
+    parser.add_argument('--chunk', default=65536, type=int, help="Records per chunk index entry")
+    args = parser.parse_args()
+
+    convert = from_cbor if args.src.endswith(".cbor") else from_text
+    convert(args.src, args.dst, chunk_records=args.chunk)
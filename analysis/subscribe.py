@@ -0,0 +1,82 @@
+import asyncio
+import logging
+import threading
+
+from unis.measurements import Function
+'''
+    Event-driven access to measurement streams.
+
+    The DataService applies every attached Function to each value as it arrives, so a Function is
+    also the natural place to wake consumers up. subscribe() attaches one dispatching Function per
+    metadata and calls its subscribers from there; stream() wraps that in an async iterator. Nothing
+    runs between values, so watching a stream costs no CPU while it is idle.
+
+        unsubscribe = subscribe(md, lambda value, ts: print(value))
+
+        async for value, ts in stream(md):
+            print(value)
+'''
+
+class _Dispatcher(Function):
+    def __init__(self):
+        super(_Dispatcher, self).__init__()
+        self.callbacks  = []
+        self.lock       = threading.Lock()
+
+    def apply(self, value, ts):
+        with self.lock:
+            callbacks = list(self.callbacks)
+        for callback in callbacks:
+            try:
+                callback(value, ts)
+            except Exception:
+                logging.exception("Measurement subscriber failed")
+        return value
+
+_dispatchers = {}
+_lock        = threading.Lock()
+
+def _dispatcher(md):
+    with _lock:
+        dispatcher = _dispatchers.get(md.id)
+        if dispatcher is None:
+            dispatcher = _dispatchers[md.id] = _Dispatcher()
+            md.data.attachFunction(dispatcher, '_subscribers')
+        return dispatcher
+
+def subscribe(md, callback):
+    '''
+        Call @callback(value, ts) for every new value of metadata @md.
+        Callbacks run on the thread that delivers the data, so they should return quickly.
+        returns - a function that removes the subscription.
+    '''
+    dispatcher = _dispatcher(md)
+    with dispatcher.lock:
+        dispatcher.callbacks.append(callback)
+
+    def unsubscribe():
+        with dispatcher.lock:
+            if callback in dispatcher.callbacks:
+                dispatcher.callbacks.remove(callback)
+
+    return unsubscribe
+
+async def stream(md, maxsize=1000):
+    '''
+        Async iterator over (value, ts) for every new value of metadata @md.
+        At most @maxsize values are queued for a slow consumer; after that the oldest are dropped.
+    '''
+    loop  = asyncio.get_event_loop()
+    queue = asyncio.Queue(maxsize)
+
+    def put(item):
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(item)
+
+    unsubscribe = subscribe(md, lambda value, ts: loop.call_soon_threadsafe(put, (value, ts)))
+    try:
+        while True:
+            yield await queue.get()
+    finally:
+        unsubscribe()
@@ -1,10 +1,21 @@
-import sys, logging, daemon, time, datetime, requests, argparse, json, traceback
+import sys, os, logging, daemon, time, datetime, requests, argparse, json, traceback, asyncio, random, multiprocessing, threading, signal
+from concurrent.futures import ThreadPoolExecutor
 from time import gmtime, strftime
-from threading import Thread
 from configparser import ConfigParser
 
 from unis import Runtime
 from esmond_test import ThroughputTest, HistogramOWDelayTest
+from scheduler import TestScheduler
+import sessions
+import metadata_cache
+from esmond_async import AsyncArchiveClient, ASYNC_TESTS
+from watermarks import WatermarkStore
+from discovery import MeshDiscovery
+from utils import shared_util
+from writer import MeasurementWriter
+from series_cache import SeriesCache
+from backfill import Backfill, BackfillProgress
+from sharding import HashRing, ShardMembership, worker_id
 
 TESTS = { 'throughput': ThroughputTest,
           'latency':    HistogramOWDelayTest,
@@ -24,18 +35,67 @@ class TestingDaemon:
         self.log_file       = conf['log_file']
         self.unis           = conf['unis']
         self.mesh_config    = conf['mesh_config'] 
+        self.mesh_interval  = float(conf.get('mesh_interval') or 300)
+        self.mesh_etag      = None
+        self.mesh_modified  = None
+        self.workers        = int(conf.get('workers') or 8)
+        self.jitter         = float(conf.get('jitter') or 0.1)
+        self.async_mode     = str(conf.get('async_mode') or '').lower() in ('1', 'true', 'yes')
+        self.per_host       = int(conf.get('per_host') or 16)
+        self.pool_size      = int(conf.get('pool_size') or max(10, self.workers))
+        self.retries        = int(conf.get('retries') or 3)
+        self.timeout        = float(conf.get('timeout') or 60)
+        self.rate_limit     = float(conf.get('rate_limit') or 20)
+        self.rate_burst     = float(conf.get('rate_burst') or 2 * self.rate_limit)
+        self.breaker_failures = int(conf.get('breaker_failures') or 5)
+        self.breaker_reset  = float(conf.get('breaker_reset') or 30)
+        self.poll_deadline  = float(conf.get('poll_deadline') or 120)
+        self.metadata_ttl   = float(conf.get('metadata_ttl') or 300)
+        self.discovery      = conf.get('discovery') or 'source'
+        self.state_dir      = conf.get('state_dir') or 'state'
+        self.shards         = int(conf.get('shards') or 1)
+        self.shard_id       = conf.get('shard_id')
+        self.shard_dir      = conf.get('shard_dir') or os.path.join(self.state_dir, 'shards')
+        self.membership     = ShardMembership(self.shard_dir, self.shard_id) if self.shard_id else None
+        self.ring           = HashRing([self.shard_id]) if self.shard_id else None
+        self.watermarks     = WatermarkStore(os.path.join(self.state_dir, 'watermarks-%s.json' % self.shard_id), peers=os.path.join(self.state_dir, 'watermarks*.json')) \
+                              if self.shard_id else WatermarkStore(os.path.join(self.state_dir, 'watermarks.json'))
+        self.writer         = MeasurementWriter(self.unis,
+                                                max_points=int(conf.get('flush_points') or 5000),
+                                                max_delay=float(conf.get('flush_interval') or 5),
+                                                spill_dir=os.path.join(self.state_dir, 'spill', *([self.shard_id] if self.shard_id else [])))
+        self.ingest         = conf.get('ingest') or 'all'
+        cache_mb            = float(conf.get('series_cache_mb') or 0)
+        self.series_cache   = SeriesCache(os.path.join(self.state_dir, 'series'), max_bytes=int(cache_mb * 1024 * 1024)) \
+                              if cache_mb > 0 else None
+        self.percentiles    = tuple(float(q) for q in str(conf.get('percentiles') or '50,95,99').split(','))
+        self.backfill_chunk = int(conf.get('backfill_chunk') or 86400)
+        self.resolution     = float(conf['resolution']) if conf.get('resolution') else None
+        self.adaptive       = str(conf.get('adaptive') or 'true').lower() in ('1', 'true', 'yes')
         self.jobs           = []
-        self.threads		= []
+        self.tests          = {}
+        self.pairs          = {}
+        self.retired        = set()
+        self._pairs_lock    = threading.Lock()
+        self._stopped       = threading.Event()
+        self.scheduler      = TestScheduler(workers=self.workers, jitter=self.jitter)
         logging.basicConfig(filename=self.log_file, level=logging.INFO)
         logging.info('Log Initialized.')
  
         return
 
     def begin(self):
+        signal.signal(signal.SIGTERM, _terminate)
+        if self.shards > 1 and not self.shard_id:
+            return self._coordinate()
+
         logger = logging.getLogger()
         fh = logging.FileHandler(self.log_file)
         logger.addHandler(fh)
 
+        if self.membership is not None:
+            self.membership.heartbeat()
+            threading.Thread(target=self._heartbeat_loop, name="heartbeat", daemon=True).start()
         self._setup()
 
         #with daemon.DaemonContext(files_preserve = [fh.stream]):
@@ -46,25 +106,278 @@ class TestingDaemon:
 				Unis: %s\n\
 				Mesh: %s", self.archive_url, self.unis, self.mesh_config)
         logging.info("Starting jobs") 
+
+        if self.async_mode:
+            try:
+                return asyncio.run(self._run_async())
+            finally:
+                self.stop()
         
         for job in self.jobs: 
-            
-            self._log("Init thread for " + job['description'])
-            
-            if len(job['members']['members']) > 2:
-                members = job['members']['members']
-                pairs = [(member1, member2) for member1 in members for member2 in members]
-                [print(p) for p in pairs]
-                    
-                for p in pairs:
-                    test_thread = Thread(target=self._init_test_thread, args=(job,p[0],p[1],self.conf,)).start()
-                    time.sleep(2)
-                    if test_thread is not None:             
-                        self.threads.append(test_thread)
-                    else:
-                        print("Thread for " + p[0] + "-" + p[1] + " none type thread")
+            self.pairs.update(self._job_pairs(job))
         
-        return 
+        if self.membership is None:
+            self._reconcile()
+            logging.info("Scheduled %s tests on %s workers", len(self.scheduler.keys()), self.workers)
+        else:
+            # workers started together only see each other once every one has written a heartbeat
+            self.scheduler.add('shards', self._reconcile, self.membership.timeout / 3, delay=self.membership.timeout / 3)
+        if self.mesh_interval > 0:
+            self.scheduler.add('mesh', self._reload_mesh, self.mesh_interval, delay=self.mesh_interval)
+        self.scheduler.add('session-stats', self._log_session_stats, 300, delay=300)
+        self.scheduler.start()
+        try:
+            while True:
+                time.sleep(60)
+        finally:
+            self.stop()
+
+    def stop(self):
+        '''
+            Stops polling, sends the buffered points and saves the high-water marks. Runs on exit, including SIGTERM.
+        '''
+        logging.info("Stopping")
+        self._stopped.set()
+        self.scheduler.stop(wait=False)
+        self.writer.stop()
+        self.watermarks.stop()
+        if self.membership is not None:
+            self.membership.leave()
+
+    def _heartbeat_loop(self):
+        '''
+            Renews this worker's heartbeat on its own thread, so a fetch pool that is busy with slow polls
+            does not make the worker look gone to its peers.
+        '''
+        while not self._stopped.wait(self.membership.timeout / 3):
+            try:
+                self.membership.heartbeat()
+            except OSError as e:
+                logging.info("Could not renew heartbeat for %s | %s", self.shard_id, e)
+
+    def _coordinate(self):
+        '''
+            Runs @shards worker processes on this host, each polling its share of the mesh, and restarts
+            any that exit. Worker i always gets the id <hostname>-i, so a restarted worker takes back its pairs.
+        '''
+        logging.info("Starting %s shard workers, membership in %s", self.shards, self.shard_dir)
+        workers = {}
+        try:
+            while True:
+                for i in range(self.shards):
+                    proc = workers.get(i)
+                    if proc is not None and proc.is_alive():
+                        continue
+                    if proc is not None:
+                        logging.info("Shard worker %s exited with code %s, restarting", proc.name, proc.exitcode)
+                    proc = multiprocessing.Process(target=_run_shard, args=(self.conf, worker_id(i)), name=worker_id(i))
+                    proc.start()
+                    workers[i] = proc
+                time.sleep(5)
+        finally:
+            for proc in workers.values():
+                proc.terminate()
+
+    def _update_ring(self):
+        '''
+            Rebuilds the hash ring from the live workers.
+            returns - True if the set of workers changed.
+        '''
+        members = self.membership.members()
+        if members == self.ring.nodes:
+            return False
+
+        logging.info("Shard workers changed to %s", ", ".join(sorted(members)))
+        for node in self.ring.nodes - members:
+            self.ring.remove(node)
+        for node in members - self.ring.nodes:
+            self.ring.add(node)
+        return True
+
+    def _owns(self, key):
+        return self.ring is None or self.ring.owner(key) == self.shard_id
+
+    def _reconcile(self):
+        '''
+            Schedules the known pairs this worker owns and retires the scheduled pairs it no longer owns,
+            leaving everything else running. Without sharding every pair is owned.
+        '''
+        with self._pairs_lock:
+            if self.membership is not None:
+                self._update_ring()
+
+            desired = {key for key in self.pairs if key not in self.retired and self._owns(key)}
+            current = {key for key in self.scheduler.keys() if isinstance(key, tuple) and len(key) == 3}
+            added, removed = desired - current, current - desired
+
+            for key in removed:
+                self.scheduler.remove(key)
+                self.tests.pop(key, None)
+            if added and self.membership is not None:
+                # marks of pairs taken over from another worker
+                self.watermarks.reload()
+            for key in added:
+                job, src, dst, interval = self.pairs[key]
+                self.scheduler.add(key, lambda job=job, src=src, dst=dst: self._run_test(job, src, dst), interval)
+
+        if added or removed:
+            logging.info("Polling %s pairs, %s added, %s removed", len(desired), len(added), len(removed))
+
+    def backfill(self, start, end):
+        '''
+            Loads every pair of the mesh for [@start, @end] into UNIS instead of polling, in chunks of
+            @backfill_chunk seconds fetched by @workers threads. Progress is kept in the state directory,
+            so running the same backfill again resumes it.
+            returns - the number of chunks that failed.
+        '''
+        self._setup()
+        logging.info("Backfilling %s - %s in chunks of %ss", start, end, self.backfill_chunk)
+
+        tests = []
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for job in self.jobs:
+                test_type = job['description']
+                if test_type not in TESTS.keys() or len(job['members']['members']) <= 2:
+                    continue
+                index = self._discover(job)
+                pairs = [pair for pair in _mesh_pairs(job['members']['members']) if index is None or pair in index]
+                tests.extend(pool.map(lambda pair, test_type=test_type: self._backfill_test(test_type, *pair), pairs))
+        tests = [test for test in tests if test is not None]
+
+        progress = BackfillProgress(os.path.join(self.state_dir, 'backfill-%d-%d-%d.progress' % (start, end, self.backfill_chunk)))
+        try:
+            failed = Backfill(start, end, chunk=self.backfill_chunk, workers=self.workers, progress=progress).run(tests)
+        finally:
+            self.writer.stop()
+            progress.close()
+            
+        self._log_session_stats()
+        return failed
+
+    def _backfill_test(self, test_type, source, destination):
+        try:
+            test = TESTS[test_type](self.archive_url, source=source, destination=destination, runtime=self.rt, **self._test_options(TESTS[test_type]))
+        except Exception as e:
+            self._log("Could not start test for " + test_type + "| " + source + " - " + destination)
+            return None
+        if len(test.archive) == 0 or test.archive[0] is None:
+            return None
+        return test
+
+    def _job_pairs(self, job):
+        '''
+            The pairs of @job that the archive has tests for, {(test type, src, dst): (job, src, dst, interval)}.
+            _reconcile schedules the ones this worker owns.
+        '''
+        pairs     = {}
+        test_type = job['description']
+        interval  = job['parameters']['interval'] if 'interval' in job['parameters'] else 120
+
+        if test_type not in TESTS.keys():
+            self._log("Test not defined for " + test_type + ". Skipping job")
+            return pairs
+
+        self._log("Scheduling tests for " + test_type)
+
+        if len(job['members']['members']) > 2:
+            index = self._discover(job)
+            for src, dst in _mesh_pairs(job['members']['members']):
+                if index is not None and (src, dst) not in index:
+                    continue
+                pairs[(test_type, src, dst)] = (job, src, dst, interval)
+
+        return pairs
+
+    def _reload_mesh(self):
+        '''
+            Polls the mesh config and applies only what changed: jobs that are new or changed are
+            discovered again and their new pairs started, pairs of removed jobs and members are retired,
+            and every other pair keeps running with its test objects and cached listings.
+        '''
+        try:
+            mesh = self._fetch_mesh()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            logging.info("Could not reload mesh config %s | %s", self.mesh_config, e)
+            return
+        if mesh is None:
+            return
+
+        old     = _jobs_by_description(self.jobs)
+        new     = _jobs_by_description(mesh['tests'])
+        changed = [d for d in new if d not in old or _job_signature(new[d]) != _job_signature(old[d])]
+        dropped = [d for d in old if d not in new]
+        self.mesh, self.jobs = mesh, list(mesh['tests'])
+        if not changed and not dropped:
+            return
+
+        logging.info("Mesh config changed - new or changed jobs: %s, removed jobs: %s", changed, dropped)
+        for key in self.scheduler.keys():
+            if isinstance(key, tuple) and key[0] == 'discovery' and (key[1] in changed or key[1] in dropped):
+                self.scheduler.remove(key)
+
+        pairs = {key: pair for key, pair in self.pairs.items() if key[0] not in changed and key[0] not in dropped}
+        job_pairs = {}
+        for description in changed:
+            for job in new[description]:
+                job_pairs.update(self._job_pairs(job))
+        for key, pair in job_pairs.items():
+            previous = self.pairs.get(key)
+            if previous is None:
+                self.retired.discard(key)
+            elif previous[3] != pair[3]:
+                # rescheduled by _reconcile with the new interval, keeping its test object
+                self.scheduler.remove(key)
+            pairs[key] = pair
+
+        with self._pairs_lock:
+            self.pairs = pairs
+        self._reconcile()
+
+    def _fetch_mesh(self):
+        '''
+            Conditional GET of the mesh config, using the ETag and Last-Modified of the previous fetch.
+            returns - the mesh document, or None if it has not changed.
+        '''
+        headers = {}
+        if self.mesh_etag:
+            headers['If-None-Match'] = self.mesh_etag
+        if self.mesh_modified:
+            headers['If-Modified-Since'] = self.mesh_modified
+
+        response = sessions.get_session().get(self.mesh_config, headers=headers)
+        if response.status_code == 304:
+            return None
+        response.raise_for_status()
+        mesh = response.json()
+
+        self.mesh_etag      = response.headers.get('ETag')
+        self.mesh_modified  = response.headers.get('Last-Modified')
+        return mesh
+
+    def _discover(self, job):
+        '''
+            Lists the archive for a whole job at once and primes the metadata cache for its pairs.
+            The listing is repeated before the cached copies expire.
+            returns - the discovery index, or None if discovery is off or failed.
+        '''
+        if self.discovery == 'off':
+            return None
+
+        event_type  = TESTS[job['description']].event_type
+        members     = job['members']['members']
+        discovery   = MeshDiscovery(self.archive_url, mode=self.discovery)
+        try:
+            index = discovery.prime(event_type, members)
+        except Exception as e:
+            self._log("Mesh discovery failed for " + job['description'] + ", falling back to per pair listings")
+            return None
+
+        def rediscover():
+            discovery.prime(event_type, members)
+
+        refresh = self.metadata_ttl * 0.75
+        self.scheduler.add(('discovery', job['description'], _job_signature(job)), rediscover, refresh, delay=refresh)
+        return index
 
     def _setup(self):
         '''
@@ -74,9 +387,17 @@ class TestingDaemon:
 			Exit if configuration fails.
         '''			
         
+        sessions.configure(pool_size=self.pool_size, retries=self.retries, timeout=(5, self.timeout),
+                           rate=self.rate_limit, burst=self.rate_burst,
+                           failures=self.breaker_failures, reset=self.breaker_reset)
+        metadata_cache.configure(ttl=self.metadata_ttl).start()
+        self.writer.start()
+        self.watermarks.start()
+
         try:
             self.rt = Runtime(self.unis)
             self.rt.addService("unis.services.data.DataService")
+            shared_util(self.rt)
         except Exception as e:
             print(e)
             logging.info("COULD NOT CONNECT TO UNIS")
@@ -90,10 +411,10 @@ class TestingDaemon:
     def _handle_mesh(self):
 
         try:
-            mesh = requests.get(self.mesh_config).json()
-        except:
+            mesh = self._fetch_mesh()
+        except (requests.exceptions.RequestException, ValueError) as e:
             print("could not get mesh config. ensure url is correct.")
-            
+            raise AttributeError(e)
         
         self.mesh = mesh
         for test in mesh['tests']:
@@ -105,33 +426,185 @@ class TestingDaemon:
         now = strftime("%Y-%m-%d %H:%M:%S", gmtime())
         return logging.info(msg + " | " + now)    
 
-    def _init_test_thread(self, job, member1, member2, conf): 
-        source          = member1
-        destination     = member2 
+    def _test_options(self, test_class):
+        '''
+            Keyword arguments shared by every test of @test_class.
+        '''
+        options = {'watermarks': self.watermarks, 'writer': self.writer, 'ingest': self.ingest,
+                   'series_cache': self.series_cache, 'resolution': self.resolution, 'adaptive': self.adaptive}
+        if issubclass(test_class, HistogramOWDelayTest):
+            options['percentiles'] = self.percentiles
+        return options
+
+    def _log_session_stats(self):
+        stats = sessions.get_session().stats()
+        cache = metadata_cache.get_cache()
+        logging.info("HTTP connections - requests: %s, opened: %s, reused: %s, hosts: %s",
+                     stats['requests'], stats['connections'], stats['reused'], stats['hosts'])
+        logging.info("Archive listings - hits: %s, misses: %s, revalidated: %s",
+                     cache.hits, cache.misses, cache.revalidated)
+        logging.info("UNIS writes - posts: %s, points: %s, spilled: %s",
+                     self.writer.posts, self.writer.points, self.writer.spilled)
+        for host, (state, refused) in sessions.get_session().breakers().items():
+            logging.info("Circuit for %s is %s, %s requests refused", host, state, refused)
+
+    def _run_test(self, job, source, destination): 
+        '''
+            One scheduled fetch for a single pair. The test object is built on first use, on the worker
+            thread, so startup does not wait on archive lookups.
+            Returns False when the archive has no test for the pair, so it should no longer be polled, or the
+            delay until the next poll when the test has learned when its next result is due. A test that could
+            not be built, eg. while the archive is down, is tried again on the next poll.
+        '''
         test_type       = job['description']
-        interval        = job['parameters']['interval'] if 'interval' in job['parameters'] else 120 
+        interval        = job['parameters']['interval'] if 'interval' in job['parameters'] else 120
+        key             = (test_type, source, destination)
+        run             = self.tests.get(key)
 
-        
-        logging.info("Trying test for %s - %s", source, destination)
-        
+        if run is None:
+            logging.info("Trying test for %s - %s", source, destination)
+            try:
+                run = TESTS[test_type](self.archive_url, source=source, destination=destination, runtime=self.rt, **self._test_options(TESTS[test_type]))
+                self.tests[key] = run
+            except Exception as e:    
+                self._log("Could not start test for " + test_type + "| " + source + " - " + destination + ", retrying | " + str(e))
+                return True
+
+        logging.info("Fetching %s from %s -> %s", test_type, source, destination)
+        with sessions.deadline(self.poll_deadline):
+            data = run.fetch(time_range=3600, upload=True) 
+        if data is None:
+            self._log("Bad test for " + test_type + "| " + source + " - " + destination)
+            self.retired.add(key)
+            return False
+
+        delay = run.next_poll(interval)
+        return True if delay is None else delay
+
+    async def _run_async(self):
+        '''
+            Polls every pair of every job on a single event loop, sharing one archive client.
+            Jobs are discovered first, as in threaded mode, and the scheduler only runs the rediscovery.
+            Shard workers check membership like in threaded mode and move polls when workers join or leave.
+        '''
+        client = AsyncArchiveClient(per_host=self.per_host)
+        loop = asyncio.get_event_loop()
+        pairs, polls = {}, {}
+        for job in self.jobs:
+            test_type = job['description']
+            if test_type not in TESTS.keys() or len(job['members']['members']) <= 2:
+                continue
+            index = await loop.run_in_executor(None, self._discover, job)
+            for src, dst in _mesh_pairs(job['members']['members']):
+                if index is not None and (src, dst) not in index:
+                    continue
+                pairs[(test_type, src, dst)] = job
+
+        self.scheduler.start()
         try:
-            if test_type not in TESTS.keys():
+            if self.membership is None:
+                self._reconcile_async(pairs, polls, client)
+                logging.info("Polling %s tests on one event loop, %s requests per host", len(polls), self.per_host)
+                await asyncio.gather(*polls.values())
                 return
+            while True:
+                # the first check waits one heartbeat period, see begin
+                await asyncio.sleep(self.membership.timeout / 3)
+                self._update_ring()
+                self._reconcile_async(pairs, polls, client)
+        finally:
+            for poll in polls.values():
+                poll.cancel()
+            await client.close()
+
+    def _reconcile_async(self, pairs, polls, client):
+        '''
+            _reconcile for async mode: starts a poll in @polls for every pair of @pairs this worker owns
+            and cancels the polls of pairs it no longer owns.
+        '''
+        desired = {key for key in pairs if key not in self.retired and self._owns(key)}
+        added, removed = desired - set(polls), set(polls) - desired
+
+        for key in removed:
+            polls.pop(key).cancel()
+        if added and self.membership is not None:
+            self.watermarks.reload()
+        for key in added:
+            polls[key] = asyncio.ensure_future(self._poll_async(pairs[key], key[1], key[2], client))
+
+        if added or removed:
+            logging.info("Polling %s pairs, %s added, %s removed", len(desired), len(added), len(removed))
+
+    async def _poll_async(self, job, source, destination, client):
+        test_type       = job['description']
+        interval        = job['parameters']['interval'] if 'interval' in job['parameters'] else 120
+        loop            = asyncio.get_event_loop()
+
+        await asyncio.sleep(random.uniform(0, interval))
+        run = None
+        while run is None:
+            try:
+                run = await loop.run_in_executor(None, lambda: ASYNC_TESTS[TESTS[test_type]](self.archive_url, source, destination, client, runtime=self.rt, **self._test_options(TESTS[test_type])))
+            except Exception as e:
+                self._log("Could not start test for " + test_type + "| " + source + " - " + destination + ", retrying | " + str(e))
+                await asyncio.sleep(interval)
 
-            run = TESTS[test_type](self.archive_url, source=source, destination=destination, runtime=self.rt)
-            self._log("THREAD OK")
-        except Exception as e:    
-            self._log("Test not defined for " + test_type + "| " + source + " - " + destination + ". Could not start thread")
-            return
-        
-        logging.info("LOG: %s test thread - updating every %s seconds.\n Src: %s, Dst: %s", test_type, interval, source, destination)
         while True:
-            print("Attempting to fetch " + test_type + " from "  + source + " -> " + destination)
-            data = run.fetch(time_range=3600, upload=True) 
+            try:
+                data = await run.fetch(time_range=3600, upload=True)
+            except Exception as e:
+                logging.exception("Fetch failed for %s | %s - %s", test_type, source, destination)
+                data = True
             if data is None:
-                return print("Bad Thread")
-            print("Fetch routine done, waiting for next interval")
-            time.sleep(interval)
+                self._log("Bad test for " + test_type + "| " + source + " - " + destination)
+                self.retired.add((test_type, source, destination))
+                return
+            delay = run.next_poll(interval)
+            await asyncio.sleep(delay if delay is not None else interval + random.uniform(-self.jitter, self.jitter) * interval)
+
+def _jobs_by_description(jobs):
+    '''
+        {description: [job, ...]} - mesh configs may hold several jobs with the same description, whose pairs
+        are tracked together.
+    '''
+    grouped = {}
+    for job in jobs:
+        grouped.setdefault(job['description'], []).append(job)
+    return grouped
+
+def _job_signature(job):
+    return json.dumps(job, sort_keys=True)
+
+def _terminate(signum, frame):
+    sys.exit(0)
+
+def _run_shard(conf, shard_id):
+    '''
+        Entry point of a shard worker process started by the coordinator.
+    '''
+    conf = dict(conf, shard_id=shard_id)
+    TestingDaemon(conf).begin()
+
+def _mesh_pairs(members):
+    '''
+        All ordered (src, dst) pairs of a mesh, without self-pairs.
+    '''
+    return [(m1, m2) for m1 in members for m2 in members if m1 != m2]
+
+def _parse_time(value):
+    '''
+        Seconds since the epoch from either a number or a UTC date such as 2020-01-31 or 2020-01-31T12:00:00.
+    '''
+    try:
+        return int(float(value))
+    except ValueError:
+        pass
+    for fmt in ("%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M:%S", "%Y-%m-%d"):
+        try:
+            return int(datetime.datetime.strptime(value, fmt).replace(tzinfo=datetime.timezone.utc).timestamp())
+        except ValueError:
+            continue
+    raise argparse.ArgumentTypeError("invalid time: " + value)
 
 def _read_config(file_path):
     if not file_path:
@@ -150,6 +623,7 @@ def _read_config(file_path):
                   'archive_url': config['archive_url'],
                   'mesh_config': config['mesh_config'],
                   'log_file': config['log_file']}
+        result.update({k: config[k] for k in ('workers', 'jitter', 'async_mode', 'per_host', 'pool_size', 'retries', 'timeout', 'state_dir', 'metadata_ttl', 'discovery', 'flush_points', 'flush_interval', 'ingest', 'percentiles', 'series_cache_mb', 'backfill_chunk', 'resolution', 'shards', 'shard_id', 'shard_dir', 'mesh_interval', 'adaptive', 'rate_limit', 'rate_burst', 'breaker_failures', 'breaker_reset', 'poll_deadline') if k in config})
         
         return result
 
@@ -158,22 +632,39 @@ def _read_config(file_path):
         raise AttributeError('Error in config file, please ensure file is '
                              'formatted correctly and contains values needed.')
     
-if __name__ == "__main__":
-    
+def main():
     parser = argparse.ArgumentParser(description='Service for grabbing test results out of Esmond and inserting them into UNIS')
     parser.add_argument('-a', '--archive', default=None, type=str, help='The HOST URL or IP of the testing archive')
     parser.add_argument('-u', '--unis', type=str, help="The UNIS url to use for saving and tracking testing results.")
     parser.add_argument('-m', '--mesh', default=None, type=str, help="URL of the Meshconfig for the tests to track.")
     parser.add_argument('-l', '--log', default="logs/esmond_uploader.log", help="Path to log file")
     parser.add_argument('-c', '--config', default=None, type=str, help="Path to configuration file.")
+    parser.add_argument('-w', '--workers', default=None, type=int, help="Number of worker threads used to fetch tests.")
+    parser.add_argument('-j', '--jitter', default=None, type=float, help="Fraction of a test's interval used to spread its polls.")
+    parser.add_argument('--async', dest='async_mode', default=None, action='store_const', const='true', help="Poll all tests on a single asyncio event loop.")
+    parser.add_argument('--per-host', dest='per_host', default=None, type=int, help="Maximum concurrent archive requests per host in async mode.")
+    parser.add_argument('--pool-size', dest='pool_size', default=None, type=int, help="Kept-alive HTTP connections per host.")
+    parser.add_argument('--shards', dest='shards', default=None, type=int, help="Number of worker processes to split the mesh across.")
+    parser.add_argument('--shard-id', dest='shard_id', default=None, type=str, help="Run as the single shard worker with this id.")
+    parser.add_argument('--shard-dir', dest='shard_dir', default=None, type=str, help="Membership directory shared by the shard workers of every host.")
+    parser.add_argument('--backfill', nargs=2, default=None, type=_parse_time, metavar=('START', 'END'), help="Load the mesh's history between START and END (epoch seconds or UTC dates) and exit.")
+    parser.add_argument('--chunk', dest='backfill_chunk', default=None, type=int, help="Seconds of data per archive request when backfilling.")
     
     args = parser.parse_args()
+    backfill = args.backfill
+    del args.backfill
     
     conf = {'unis':args.unis, 'archive_url':args.archive, 'mesh_config':args.mesh, 'log_file':args.log}
     conf.update(**_read_config(args.config))
     conf.update(**{k:v for k,v in args.__dict__.items() if v is not None})
     print(conf)
     app = TestingDaemon(conf)
+    if backfill:
+        print("Starting backfill")
+        sys.exit(1 if app.backfill(*backfill) else 0)
     print("Starting App")
     app.begin()
 
+if __name__ == "__main__":
+    main()
+
@@ -0,0 +1,130 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+'''
+    Historical backfill.
+
+    A [start, end] range is split into fixed size chunks for every pair and event type, and the
+    chunks are fetched in parallel by a bounded pool. Each chunk is written to UNIS through the
+    shared writer as soon as it arrives, so memory is bounded by the chunks in flight rather than by
+    the length of the range. Chunks whose points have been posted or spilled by the writer are
+    appended to a progress file, and a run that is interrupted and started again with the same range
+    and chunk size skips them.
+'''
+
+def chunks(start, end, size):
+    '''
+        Consecutive inclusive (start, end) ranges of at most @size seconds covering [@start, @end].
+    '''
+    result = []
+    while start <= end:
+        result.append((start, min(start + size - 1, end)))
+        start += size
+    return result
+
+class BackfillProgress:
+    '''
+        Completed chunks, kept as an append-only log at @path with one "key start end" line per chunk.
+    '''
+    def __init__(self, path):
+        self.path   = path
+        self.done   = set()
+        self._lock  = threading.Lock()
+
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    parts = line.rsplit(" ", 2)
+                    if len(parts) == 3:
+                        self.done.add((parts[0], int(parts[1]), int(parts[2])))
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, "a")
+
+        return
+
+    def is_done(self, key, start, end):
+        return (key, start, end) in self.done
+
+    def mark(self, key, start, end):
+        with self._lock:
+            self.done.add((key, start, end))
+            self._file.write("%s %d %d\n" % (key, start, end))
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+class Backfill:
+    '''
+        param: start, end - the time range to load, in seconds since the epoch.
+        param: chunk - seconds of data per archive request.
+        param: workers - maximum number of chunks fetched at the same time.
+        param: progress - a BackfillProgress, or None to always load every chunk.
+    '''
+    def __init__(self, start, end, chunk=86400, workers=8, progress=None):
+        self.start      = int(start)
+        self.end        = int(end)
+        self.chunk      = int(chunk)
+        self.workers    = workers
+        self.progress   = progress
+        self.loaded     = 0
+        self.skipped    = 0
+        self.failed     = 0
+        self.points     = 0
+        self._lock      = threading.Lock()
+
+        return
+
+    def run(self, tests):
+        '''
+            Loads the range for every test in @tests. A test must have src, dst, backfill_events and
+            ingest_range(event_type, start, end), see EsmondTest.
+            Chunks are taken oldest first across all tests, and at most twice @workers are queued at a time.
+            returns - the number of chunks that failed; they are loaded again on the next run.
+        '''
+        began = time.time()
+        work = ((test, event_type, a, b) for a, b in chunks(self.start, self.end, self.chunk)
+                                         for test in tests
+                                         for event_type in test.backfill_events)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            pending = set()
+            for test, event_type, a, b in work:
+                key = "|".join([event_type, test.src, test.dst])
+                if self.progress is not None and self.progress.is_done(key, a, b):
+                    self.skipped += 1
+                    continue
+                if len(pending) >= self.workers * 2:
+                    finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                pending.add(pool.submit(self._load, test, event_type, key, a, b))
+            wait(pending)
+
+        logging.info("Backfill finished in %.0fs - chunks loaded: %s, skipped: %s, failed: %s, points: %s",
+                     time.time() - began, self.loaded, self.skipped, self.failed, self.points)
+        return self.failed
+
+    def _load(self, test, event_type, key, start, end):
+        try:
+            count = test.ingest_range(event_type, start, end)
+        except Exception as e:
+            logging.info("Backfill of %s %s - %s failed | %s", key, start, end, e)
+            count = None
+
+        with self._lock:
+            if count is None:
+                self.failed += 1
+                return
+            self.loaded += 1
+            self.points += count
+
+        if self.progress is None:
+            return
+        if test.writer is None:
+            self.progress.mark(key, start, end)
+        else:
+            test.writer.when_sent(lambda: self.progress.mark(key, start, end))
@@ -0,0 +1,122 @@
+import threading
+import time
+'''
+    Failure isolation and rate limiting for remote endpoints.
+
+    A CircuitBreaker stops requests to a host after repeated failures, lets a single probe through
+    once a cool-down has passed, and closes again when the probe succeeds. After closing it reports a
+    ramp fraction that grows back to 1, which the host's TokenBucket applies to its rate, so traffic to
+    a recovered host builds up gradually instead of arriving all at once.
+'''
+
+class CircuitBreaker:
+    '''
+        param: failures - consecutive failures that open the circuit.
+        param: reset - seconds the circuit stays open before a probe is let through. Every failed probe
+               doubles this, up to @max_reset.
+        param: ramp - seconds over which traffic is ramped back up after the circuit closes.
+    '''
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half-open"
+
+    def __init__(self, failures=5, reset=30, max_reset=600, ramp=60):
+        self.failures   = failures
+        self.reset      = reset
+        self.max_reset  = max_reset
+        self.ramp_time  = ramp
+        self.state      = self.CLOSED
+        self.count      = 0
+        self.opened     = 0
+        self.closed     = 0
+        self.cooldown   = reset
+        self.probing    = False
+        self._lock      = threading.Lock()
+
+        return
+
+    def allow(self):
+        '''
+            True if a request may be sent now. In the half-open state only one probe is let through at a time.
+        '''
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.time() - self.opened >= self.cooldown:
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN and not self.probing:
+                self.probing = True
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                self.state    = self.CLOSED
+                self.closed   = time.time()
+                self.cooldown = self.reset
+            self.count   = 0
+            self.probing = False
+
+    def failure(self):
+        with self._lock:
+            self.probing = False
+            if self.state == self.HALF_OPEN:
+                self.cooldown = min(self.cooldown * 2, self.max_reset)
+                self._open()
+                return
+            self.count += 1
+            if self.state == self.CLOSED and self.count >= self.failures:
+                self._open()
+
+    def cancel(self):
+        '''
+            Gives back a permission from allow() that was not used to send a request.
+        '''
+        with self._lock:
+            self.probing = False
+
+    def ramp(self):
+        '''
+            Fraction of the normal request rate to allow, from 0.1 right after closing up to 1.
+        '''
+        if not self.closed or self.ramp_time <= 0:
+            return 1.0
+        return min(1.0, 0.1 + 0.9 * (time.time() - self.closed) / self.ramp_time)
+
+    def _open(self):
+        self.state  = self.OPEN
+        self.opened = time.time()
+
+class TokenBucket:
+    '''
+        param: rate - tokens added per second.
+        param: burst - maximum number of tokens saved up.
+    '''
+    def __init__(self, rate, burst=None):
+        self.rate       = float(rate)
+        self.burst      = float(burst or max(rate, 1))
+        self.tokens     = self.burst
+        self.last       = time.time()
+        self._lock      = threading.Lock()
+
+        return
+
+    def reserve(self, scale=1.0):
+        '''
+            Takes one token, borrowing against future refills if the bucket is empty.
+            param: scale - fraction of @rate to refill at, see CircuitBreaker.ramp.
+            returns - seconds to wait before the token may be used.
+        '''
+        with self._lock:
+            now = time.time()
+            rate = self.rate * scale
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * rate)
+            self.last = now
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / rate
+
+    def cancel(self):
+        '''
+            Returns a reserved token that was not used.
+        '''
+        with self._lock:
+            self.tokens = min(self.burst, self.tokens + 1)
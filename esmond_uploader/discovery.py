@@ -0,0 +1,90 @@
+import logging
+
+from esmond_query import EsmondQuery, EsmondQueryHandler
+from metadata_cache import get_cache
+'''
+    Mesh-level archive discovery.
+
+    Rather than every (source, destination) pair listing its own archive entries, a mesh is
+    discovered with one listing per source (or a single paged listing per event type) and the result
+    is split locally into per-pair listings. Those are primed into the metadata cache under the same
+    url each test would query, so building the per-pair tests costs no further archive requests.
+'''
+
+class MeshDiscovery:
+    '''
+        param: archive_url - the archive host, as passed to the tests.
+        param: mode - "source" for one listing per mesh member, "all" for one listing per event type.
+        param: page_size - number of entries requested per page in "all" mode.
+    '''
+    def __init__(self, archive_url, mode="source", page_size=1000):
+        self.archive_url    = archive_url
+        self.mode           = mode
+        self.page_size      = page_size
+
+        return
+
+    def discover(self, event_type, members):
+        '''
+            Lists the archive entries for @event_type between @members.
+            returns - {(src, dst): [<archive entry dict>, ...]} for every pair that has entries.
+        '''
+        members = set(members)
+        index, count = {}, 0
+        for entry in self._entries(event_type, members):
+            count += 1
+            srcs = {entry.get('source'), entry.get('input-source')} & members
+            dsts = {entry.get('destination'), entry.get('input-destination')} & members
+            for src in srcs:
+                for dst in dsts:
+                    if src != dst:
+                        index.setdefault((src, dst), []).append(entry)
+
+        logging.info("Discovered %s %s pairs with %s listing entries", len(index), event_type, count)
+        return index
+
+    def prime(self, event_type, members):
+        '''
+            Discovers @members and stores a listing for every pair in the metadata cache, including
+            empty listings for pairs without entries.
+            returns - the discovery index, see discover().
+        '''
+        index = self.discover(event_type, members)
+        cache = get_cache()
+        for src in members:
+            for dst in members:
+                if src == dst:
+                    continue
+                url = pair_url(self.archive_url, event_type, src, dst)
+                cache.put(url, index.get((src, dst), []), managed=True)
+
+        return index
+
+    def _entries(self, event_type, members):
+        '''
+            Yields the listing entries as they are parsed, so only the ones between members are kept.
+        '''
+        if self.mode == "all":
+            offset = 0
+            while True:
+                count = 0
+                for entry in self._list(EsmondQuery(self.archive_url, event_type=event_type,
+                                                    limit=str(self.page_size), offset=str(offset))):
+                    count += 1
+                    yield entry
+                if count < self.page_size:
+                    return
+                offset += self.page_size
+        else:
+            for src in members:
+                for entry in self._list(EsmondQuery(self.archive_url, event_type=event_type, source=src)):
+                    yield entry
+
+    def _list(self, query):
+        return EsmondQueryHandler(query).items()
+
+def pair_url(archive_url, event_type, src, dst):
+    '''
+        The listing url a test for (@src, @dst) queries, see EsmondTest.
+    '''
+    return EsmondQueryHandler(EsmondQuery(archive_url, event_type=event_type, source=src, destination=dst)).query_url
@@ -0,0 +1,195 @@
+import asyncio
+import logging
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from esmond_query import EsmondQuery
+from esmond_test import EsmondTest, ThroughputTest, HistogramOWDelayTest
+from metadata_cache import get_cache
+from sessions import get_session
+import jsonstream
+'''
+    Asyncio versions of the Esmond tests.
+
+    The classes here mirror the fetch(time_range, upload) contract of the tests in esmond_test, but
+    talk to the archive through a shared AsyncArchiveClient so that a single event loop can poll
+    a large number of source/destination pairs. Uploads to UNIS are still blocking and are run in the
+    loop's default executor.
+'''
+
+class AsyncArchiveClient:
+    '''
+        Shared async HTTP client for the archive.
+
+        param: per_host - maximum number of requests in flight to a single host.
+        param: timeout - total timeout in seconds for a single request.
+    '''
+    def __init__(self, per_host=16, timeout=60):
+        self.per_host   = per_host
+        self.timeout    = timeout
+        self._session   = None
+        self._limits    = {}
+
+        return
+
+    def _session_for_loop(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=0, limit_per_host=self.per_host)
+            self._session = aiohttp.ClientSession(connector=connector,
+                                                  timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self._session
+
+    def _limit(self, url):
+        host = urlsplit(url).netloc
+        if host not in self._limits:
+            self._limits[host] = asyncio.Semaphore(self.per_host)
+        return self._limits[host]
+
+    async def get_json(self, url):
+        '''
+            Goes through the same per-host circuit breaker and rate limit as the blocking session.
+        '''
+        session = self._session_for_loop()
+        endpoint = get_session().endpoint(url)
+        wait = endpoint.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        async with self._limit(url):
+            try:
+                async with session.get(url) as response:
+                    endpoint.record(response.status)
+                    response.raise_for_status()
+                    return [item async for item in jsonstream.aitems(response)]
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                endpoint.record(None)
+                raise
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+class AsyncEsmondTest(EsmondTest):
+    '''
+        Base class for async tests. Archive listing and data requests go through @client; the
+        result handling and upload code is shared with EsmondTest.
+    '''
+    def __init__(self, query, client, runtime=None, watermarks=None, writer=None, ingest="all", series_cache=None,
+                 summary=None, resolution=None, adaptive=True):
+        EsmondTest.__init__(self, query, runtime=runtime, watermarks=watermarks, writer=writer, ingest=ingest,
+                            series_cache=series_cache, summary=summary, resolution=resolution, adaptive=adaptive)
+        self.client     = client
+        self.archive    = None
+
+        return
+
+    async def pull(self, latest=False):
+        url     = self.query_handler.query_url
+        listing = get_cache().lookup(url)
+        if listing is None:
+            logging.info("pulling test entries from Esmond")
+            listing = get_cache().put(url, await self.client.get_json(url))
+
+        self.latest     = listing.latest
+        self.events     = listing.events
+        self.archive    = [listing.latest] if latest else listing.archive
+
+        return self.archive
+
+    async def fetch_data(self, event_type, time_range=None, summary=None, since=None):
+        logging.info("Begin fetching %s test data within time range %s", event_type, time_range)
+
+        await self.pull(latest=True)
+        data_url = self.data_query(event_type, time_range=time_range, summary=summary, since=since)
+        cached   = self.cache_range(event_type, time_range=time_range, summary=summary, since=since)
+
+        self.fetch_failed = False
+        try:
+            if cached is None:
+                return await self.client.get_json(data_url)
+
+            for a, b in self.series_cache.missing(*cached):
+                points = await self.client.get_json(self.data_query(event_type, start=a, end=b))
+                await self.run_blocking(self.series_cache.store, cached[0], cached[1], points, a, b)
+            return await self.run_blocking(self.series_cache.read, *cached)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, OSError) as e:
+            logging.info("Failure getting data from URL: %s | %s", data_url, e)
+            self.fetch_failed = True
+            return []
+
+    async def run_blocking(self, func, *args):
+        return await asyncio.get_event_loop().run_in_executor(None, func, *args)
+
+class AsyncThroughputTest(AsyncEsmondTest, ThroughputTest):
+    def __init__(self, archive_url, source, destination, client, runtime=None, watermarks=None, writer=None, ingest="all", series_cache=None,
+                 resolution=None, adaptive=True):
+        self.src = source
+        self.dst = destination
+
+        query = EsmondQuery(archive_url, event_type="throughput", source=source, destination=destination)
+        AsyncEsmondTest.__init__(self, query, client, runtime=runtime, watermarks=watermarks, writer=writer, ingest=ingest,
+                                 series_cache=series_cache, resolution=resolution, adaptive=adaptive)
+
+        return
+
+    async def fetch(self, time_range=None, upload=False):
+        self.upload = upload
+
+        await self.pull(latest=True)
+        if len(self.archive) == 0 or self.archive[0] is None:
+            logging.info("No tests found for query | src: %s, dst: %s", self.src, self.dst)
+            return
+
+        if not self.has_new('throughput'):
+            return []
+
+        updated = self.updated('throughput')
+        since = self.since('throughput', time_range)
+        data = await self.fetch_data('throughput', time_range=time_range, since=since,
+                                     summary=self.summary_window('throughput', self.span(since, time_range)))
+        self.fetched('throughput', updated)
+        await self.run_blocking(self.handle_throughput, data)
+
+        return data
+
+class AsyncHistogramOWDelayTest(AsyncEsmondTest, HistogramOWDelayTest):
+    def __init__(self, archive_url, source, destination, client, runtime=None, summary=None, watermarks=None, writer=None, ingest="all",
+                 percentiles=(50, 95, 99), series_cache=None, resolution=None, adaptive=True):
+        self.src = source
+        self.dst = destination
+        self.percentiles = percentiles
+
+        query = EsmondQuery(archive_url, event_type="histogram-owdelay", source=source, destination=destination)
+        AsyncEsmondTest.__init__(self, query, client, runtime=runtime, watermarks=watermarks, writer=writer, ingest=ingest,
+                                 series_cache=series_cache, summary=summary, resolution=resolution, adaptive=adaptive)
+
+        return
+
+    async def fetch(self, time_range=None, upload=False):
+        self.upload = upload
+
+        await self.pull(latest=True)
+        if len(self.archive) == 0 or self.archive[0] is None:
+            logging.info("No tests found for query | src: %s, dst: %s", self.src, self.dst)
+            return
+
+        data = []
+        if self.has_new("histogram-owdelay"):
+            updated = self.updated("histogram-owdelay")
+            since = self.since("histogram-owdelay", time_range)
+            data = await self.fetch_data("histogram-owdelay", time_range=time_range, since=since,
+                                         summary=self.summary_window("histogram-owdelay", self.span(since, time_range)))
+            self.fetched("histogram-owdelay", updated)
+            await self.run_blocking(self.handle_histogram_owdelay, data)
+
+        if self.has_new("packet-count-lost"):
+            updated = self.updated("packet-count-lost")
+            loss = await self.fetch_data("packet-count-lost", time_range=time_range, since=self.since("packet-count-lost", time_range))
+            self.fetched("packet-count-lost", updated)
+            await self.run_blocking(self.handle_packet_count_loss, loss)
+
+        return data
+
+ASYNC_TESTS = { ThroughputTest: AsyncThroughputTest,
+                HistogramOWDelayTest: AsyncHistogramOWDelayTest }
@@ -2,6 +2,9 @@ import sys
 import requests
 import json
 
+from sessions import get_session
+import jsonstream
+
 class EsmondQuery:
     '''
         Extenable Object for storing query metadata.
@@ -35,14 +38,22 @@ class EsmondQueryHandler:
 
     def get(self):
         
-        try:
-            response = requests.get(self.query_url)
-            self.data     = response.json()
-        
-        except RequestException as e:
-            raise AttributeError(RequestException)
+        self.data = list(self.items())
         
         return self.data
+
+    def items(self):
+        '''
+            Yields the archive entries for the query one at a time, parsed as the response streams in.
+        '''
+        try:
+            with get_session().get(self.query_url, stream=True) as response:
+                response.raise_for_status()
+                for entry in jsonstream.items(response):
+                    yield entry
+        
+        except (requests.exceptions.RequestException, ValueError) as e:
+            raise AttributeError(e)
                 
 
 if __name__ == "__main__":
@@ -1,12 +1,24 @@
 import sys
 import json
+import time
 import requests
 import logging
 
 from esmond_query import EsmondQuery, EsmondQueryHandler
+from sessions import get_session
+from metadata_cache import get_cache, event_map
 from unis import Runtime
 from unis.models import *
-from utils import UnisUtil
+from utils import shared_util
+from watermarks import WatermarkStore
+from ingest import columns, newer_than
+from histogram import reduce_histograms
+import jsonstream
+import numpy as np
+
+# summary types whose points have the same shape as the raw ones, so they can be handled the same way
+SUMMARY_TYPES = ("aggregation", "average")
+
 '''
     In this file, create different classes that handle different testing data from Esmond and
     push the data into unis.
@@ -17,17 +29,43 @@ from utils import UnisUtil
 '''
 
 class EsmondTest:
+    backfill_events = ()
+    upload_events   = {}
+    max_points      = 1000
+    stream_batch    = 5000
+    poll_events     = ()
+    poll_grace      = 60
+
     def __init__(self,
         query,  
-        runtime=None):
+        runtime=None,
+        watermarks=None,
+        writer=None,
+        ingest="all",
+        series_cache=None,
+        summary=None,
+        resolution=None,
+        adaptive=True):
         
         self.query          = query 
+        self.summary        = summary
+        self.resolution     = resolution
+        self.adaptive       = adaptive
+        self.seen           = {}
+        self.pending        = {}
+        self.cadence        = {}
+        self.fetch_failed   = False
+        self.watermarks     = watermarks
+        self.writer         = writer
+        self.ingest         = ingest
+        self.series_cache   = series_cache
+        self.latest         = None
+        self.events         = {}
         self.query_handler  = EsmondQueryHandler(query)
         self.base_url       = self.query_handler.base_url
         self.archive_host   = query.archive_host
          
-        self.util           = UnisUtil(rt=runtime)
-        runtime.addService("unis.services.data.DataService")
+        self.util           = shared_util(runtime)
         logging.basicConfig(filename='logs/esmond_uploader.log',level=logging.DEBUG)
         
         return
@@ -39,127 +77,297 @@ class EsmondTest:
             param: bool latest - set latest param to True to set the working set of tests to the most recently updated one.
             returns - a list of valid archive dicts.
             If @latest is set, returns a list with a single archive dict entry.
-        '''
-        logging.info("pulling test entries from Esmond")
 
-        self.archive    = self.query_handler.get() 
-
-        if latest:
-            archive, timestamp = self.get_latest()
-            self.archive = [archive]
+            Listings are served from the shared metadata cache, so this only hits the archive when the
+            cached listing has expired.
+        '''
+        listing         = get_cache().get(self.query_handler.query_url)
+        self.latest     = listing.latest
+        self.events     = listing.events
+        self.archive    = [listing.latest] if latest else listing.archive
         
         return self.archive
 
-    def get_latest(self):    
+    def get_data_url(self, archive, event_type, summary_window=None):     
+        '''
+            The data url of @event_type on @archive, or of its @summary_window second summary if set.
+            Falls back to the raw points when the archive has no such summary.
         '''
-            Sets working test archive to the most recently updated test given the query results.
+        events = self.events if archive is self.latest else event_map(archive)
+        event  = events[event_type]
 
-            Just look at the first event in each archived test and compare timestamps.
-            returns - <archive entry dict>, <timestamp value>
+        if summary_window is not None:
+            for summary in event.get('summaries') or []:
+                if summary['summary-type'] in SUMMARY_TYPES and int(summary['summary-window']) == int(summary_window):
+                    return self.archive_host + summary['uri']
+            logging.info("No %ss summary of %s, fetching raw points", summary_window, event_type)
+
+        return self.archive_host + event['base-uri']
+
+    def summary_window(self, event_type, span):
         '''
-        logging.info("Setting working test archive to latest updated test")
+            Chooses the summary to fetch @span seconds of @event_type from: the coarsest summary window
+            the archive has that is no coarser than the test's resolution, which defaults to @span / max_points.
+            A window set with @summary is always used.
+            returns - the window in seconds, or None for raw points.
+        '''
+        if self.summary is not None:
+            return self.summary
+        if not span or not self.archive or self.archive[0] is None:
+            return None
 
-        latest_archive = None
-        
-        if len(self.archive) >= 1:
-            for a in self.archive:
-                if latest_archive is None:
-                    latest_archive = a
-                else:
-                    if not a['event-types'][0]['time-updated']:
-                        continue
-                    
-                    if a['event-types'][0]['time-updated'] > latest_archive['event-types'][0]['time-updated']:
-                        latest_archive = a
-            print('ARCHIVE URI: ',latest_archive['uri']) 
-            return latest_archive, latest_archive['event-types'][0]['time-updated'] 
-
-        elif len(self.archive) == 0:
-            return None, None
-        
-        
-        latest =  max(self.archive, key=lambda x:x['event-types'][0]['time-updated'] if x['event-types'][0]['time-updated'] else 0)
-        
-        return latest, latest['event-types'][0]['time-updated']
+        resolution = self.resolution or float(span) / self.max_points
+        events = self.events if self.archive[0] is self.latest else event_map(self.archive[0])
+        windows = [int(summary['summary-window']) for summary in events.get(event_type, {}).get('summaries') or []
+                   if summary['summary-type'] in SUMMARY_TYPES]
+        windows = [w for w in windows if 0 < w <= resolution]
 
-    def get_data_url(self, archive, event_type, summary_window=None):     
-        
-        sum_archive = archive
-        import pprint
-        
-        if summary_window is None:
-            '''
-            for event in archive['event-types']:
-                pprint.pprint(event)
-                if event['event-type'] == event_type:
-                    print("FOUND")
-                    pprint.pprint( event)
-            '''
-
-            event = [event for event in archive['event-types'] if event['event-type'] == event_type][0]
-            base_uri = event['base-uri']
-
-            return self.archive_host + base_uri
-            return self.archive_host + [event for event in archive['event-types'] if event['event-type'] == event_type][0]['base-uri']
-        else:
-            print(archive) 
-            #test = [event for event in archive['event-types'] if event['event-type'] == event_type]  
-            print("ARCHIVE", archive)
-            for event in archive['event-types']:
-                pprint.pprint(event)
-                print('\n')
-            print(test)
-            sys.exit(0)
-            summary = [summary for summary in test['summaries'] if summary['summary-window'] == str(summary_window)]
-            return self.archive_host + summary[0]['uri']
-        
-    def fetch_data(self, event_type, time_range=None, summary=None):    
+        return max(windows) if windows else None
+
+    def data_query(self, event_type, time_range=None, summary=None, since=None, start=None, end=None):
+        '''
+            Builds the data url for @event_type on the current working archive entry.
+            If @since is set only points strictly newer than it are requested, otherwise the last @time_range seconds.
+            @start and @end request an explicit, inclusive time window instead.
+        '''
+        data_url = self.get_data_url(self.archive[0], event_type, summary_window=summary) 
+        if start is not None:
+            data_url = data_url + "?time-start=" + str(int(start))
+            return (data_url + "&time-end=" + str(int(end))) if end is not None else data_url
+        if since is not None:
+            return data_url + "?time-start=" + str(int(since) + 1)
+        return (data_url + "?time-range=" + str(time_range)) if time_range is not None else data_url
+
+    def fetch_data(self, event_type, time_range=None, summary=None, since=None):    
         '''
             Extracts the actual test data for a given query, eg. {throughput:123456, ts:98765432}
             param: event_type - specify the string value of the event you are looking for in your query result
             param(optional): time_range - limit the query only results in the given time range (recommended, mostly to avoid pulling in huge data objects)
+            param(optional): since - only fetch points newer than this timestamp, see since()
 
-            returns - whatever dict the specified event in esmond conforms to.
+            returns - whatever dict the specified event in esmond conforms to, or an empty list if the request failed.
         '''
         logging.info("Begin fetching %s test data within time range %s", event_type, time_range)
 
         self.pull(latest=True)
-        data_url = self.get_data_url(self.archive[0], event_type, summary_window=summary) 
-        data_url = (data_url + "?time-range=" + str(time_range)) if time_range is not None else data_url
+        data_url = self.data_query(event_type, time_range=time_range, summary=summary, since=since)
+        cached   = self.cache_range(event_type, time_range=time_range, summary=summary, since=since)
 
+        self.fetch_failed = False
         try:
-            data = requests.get(data_url).json()
-        except requests.exceptions.RequestException as e:
-            print("Failure getting data from URL: ", data_url)
-            print(e)
+            if cached is not None:
+                data = self.series_cache.get(*cached, fetch=lambda a, b: self.get_json(self.data_query(event_type, start=a, end=b)))
+            else:
+                data = self.get_json(data_url)
+        except (requests.exceptions.RequestException, ValueError, OSError) as e:
+            logging.info("Failure getting data from URL: %s | %s", data_url, e)
+            self.fetch_failed = True
+            data = []
         
         return data
 
-    def upload_data(self, data, src_ip, dst_ip, event_type):
+    def get_json(self, url):
+        return list(self.iter_json(url))
+
+    def iter_json(self, url):
         '''
-            Upload the test data to the correct metadata tag.
-            - finds the link resources and their metadata objects
-            - if there is no associated metadata obj for a link, creates one
-            - adds the last test value to each metadata obj
+            Yields the points at @url one at a time, parsed as the response streams in.
         '''
-        
-        logging.info("Uploading to UNIS: %s test data for %s -> %s", event_type, src_ip, dst_ip) 
+        with get_session().get(url, stream=True) as response:
+            response.raise_for_status()
+            for item in jsonstream.items(response):
+                yield item
 
-        
-        subject_links = [self.util.check_create_virtual_link(src_ip, dst_ip)]
-        print("Subjects:", subject_links)
-        
-        for l in subject_links:
-            print("Trying link", l)
-            try: 
-                m = self.util.check_create_metadata(l, src=self.src, dst=self.dst, archive=self.archive, event=event_type)
-                print("METADATA.DATA: ", m)
-                m.append(data["val"], ts=data["ts"])
-                
-            except Exception as e:
-                print(e)
-                print("Could not add data")
-        return 
+    def cache_range(self, event_type, time_range=None, summary=None, since=None):
+        '''
+            The (metadata-key, event type, start, end) a fetch should be served from the series cache with,
+            or None when there is no cache or the fetch is not a plain time window.
+        '''
+        if self.series_cache is None or summary is not None or (since is None and time_range is None):
+            return None
+
+        key = self.archive[0].get('metadata-key')
+        if key is None:
+            return None
+
+        end = int(time.time())
+        start = int(since) + 1 if since is not None else end - int(time_range)
+        return key, event_type, start, end
+
+    def ingest_range(self, event_type, start, end):
+        '''
+            Fetches every raw point of @event_type with @start <= ts <= @end and writes it to UNIS, without
+            going through the series cache or touching high-water marks. Used by backfill.
+            Summaries are never used here, as they would be written under the raw eventTypes.
+            The response is parsed and written in batches of @stream_batch points.
+            returns - the number of points written, or None if a write failed.
+        '''
+        url = self.data_query(event_type, start=start, end=end)
+        count = 0
+        for points in jsonstream.batches(self.iter_json(url), self.stream_batch):
+            written = self.write_batch(event_type, points)
+            if written is None:
+                return None
+            count += written
+        return count
+
+    def write_batch(self, event_type, points):
+        '''
+            Writes a batch of backfilled @event_type points, see ingest_range.
+            returns - the number of points written, or None if the write failed.
+        '''
+        batch = columns(points)
+        upload_event = self.upload_events.get(event_type, event_type)
+        if not self.write_columns(batch['ts'], batch['val'], self.src, self.dst, upload_event):
+            return None
+        return len(batch)
+
+    def updated(self, event_type):
+        '''
+            The archive's time-updated for @event_type in the current listing, or None.
+        '''
+        return self.events.get(event_type, {}).get('time-updated')
+
+    def has_new(self, event_type):
+        '''
+            False when the archive's time-updated for @event_type has not moved since it was last fetched,
+            so the fetch can be skipped.
+        '''
+        if not self.adaptive:
+            return True
+        updated = self.updated(event_type)
+        return updated is None or updated != self.seen.get(event_type)
+
+    def fetched(self, event_type, updated):
+        '''
+            Records a successful fetch of @event_type at archive time-updated @updated and learns the
+            test's cadence from the gaps between updates.
+        '''
+        if self.fetch_failed or updated is None:
+            return
+        last = self.seen.get(event_type)
+        self.seen[event_type] = updated
+        if last is None or updated <= last:
+            return
+
+        cadence = self.cadence.get(event_type)
+        self.cadence[event_type] = updated - last if cadence is None else cadence + 0.25 * (updated - last - cadence)
+
+    def next_poll(self, interval):
+        '''
+            Seconds until the test should be polled again: @poll_grace seconds after its next result is
+            expected, judged from the learned cadence of every event in @poll_events.
+            returns - None to poll again after @interval, when the cadence is unknown or not longer than
+            @interval, or a result is overdue.
+        '''
+        if not self.adaptive or not self.poll_events:
+            return None
+
+        now, delays = time.time(), []
+        for event_type in self.poll_events:
+            updated, cadence = self.seen.get(event_type), self.cadence.get(event_type)
+            if updated is None or cadence is None or cadence <= interval:
+                return None
+            delays.append(updated + cadence + self.poll_grace - now)
+
+        delay = min(delays)
+        return delay if delay > interval else None
+
+    def since(self, event_type, time_range=None):
+        '''
+            The timestamp to fetch @event_type from - this test's high-water mark, but no older than @time_range seconds ago.
+            returns - None when no mark has been recorded yet.
+        '''
+        mark = self.mark(event_type)
+        if mark is not None and time_range is not None:
+            mark = max(mark, int(time.time()) - int(time_range))
+
+        return mark
+
+    def span(self, since, time_range):
+        '''
+            Seconds of data a fetch from @since, or of the last @time_range seconds, covers.
+        '''
+        return int(time.time()) - since if since is not None else time_range
+
+    def mark(self, event_type):
+        '''
+            The high-water mark for @event_type, or None.
+        '''
+        if self.watermarks is None:
+            return None
+        marks = [m for m in (self.watermarks.get(WatermarkStore.key(event_type, self.src, self.dst)),
+                             self.pending.get(event_type)) if m is not None]
+        return max(marks) if marks else None
+
+    def unseen(self, event_type, data):
+        '''
+            Filters a list of points down to the ones newer than the high-water mark for @event_type.
+        '''
+        mark = self.mark(event_type)
+        if mark is None or type(data) is not list:
+            return data
+
+        return [d for d in data if d['ts'] > mark]
+
+    def advance(self, event_type, ts):
+        '''
+            Records @ts as the newest ingested point for @event_type. The stored mark only moves once the
+            writer has posted or spilled the points, so points lost in a crash are fetched again on restart;
+            until then the test itself skips them through @pending.
+        '''
+        if self.watermarks is None:
+            return
+        self.pending[event_type] = max(ts, self.pending.get(event_type, ts))
+        key = WatermarkStore.key(event_type, self.src, self.dst)
+        if self.writer is None:
+            self.watermarks.set(key, ts)
+        else:
+            self.writer.when_sent(lambda: self.watermarks.set(key, ts))
+
+    def upload_points(self, points, src_ip, dst_ip, event_type, mark_event=None):
+        '''
+            Upload every point of @points newer than the high-water mark for @mark_event (default @event_type),
+            or only the newest one when the test's ingest mode is "latest".
+            The points are converted to timestamp/value columns once and handed to the writer as one batch.
+
+            returns - the number of points uploaded, or None if the upload failed.
+        '''
+        mark_event = mark_event or event_type
+        batch = newer_than(columns(points), self.mark(mark_event))
+        if self.ingest == "latest":
+            batch = batch[-1:]
+        if len(batch) == 0:
+            return 0
+
+        if not self.write_columns(batch['ts'], batch['val'], src_ip, dst_ip, event_type):
+            return None
+
+        self.advance(mark_event, int(batch['ts'][-1]))
+        return len(batch)
+
+    def write_columns(self, ts, values, src_ip, dst_ip, event_type):
+        '''
+            Hands timestamp/value arrays to the metadata for @event_type without touching high-water marks.
+            returns - True on success.
+        '''
+        logging.info("Uploading to UNIS: %s %s points for %s -> %s", len(ts), event_type, src_ip, dst_ip) 
+
+        try:
+            meta = self.util.resolve_metadata(src_ip, dst_ip, event_type, self.archive[0]['url'])
+            if meta is None:
+                return False
+            if self.writer is not None:
+                self.writer.write_columns(meta.id, ts, values)
+            else:
+                for t, val in zip(ts.tolist(), values.tolist()):
+                    meta.data.append(val, ts=t)
+
+        except Exception as e:
+            logging.info("Could not add %s data for %s -> %s | %s", event_type, src_ip, dst_ip, e)
+            return False
+
+        return True
 
 
 '''
@@ -170,14 +378,20 @@ class EsmondTest:
        Classes should provide the same interface of (self, archive_url, source, destination, runtime)
 '''
 class ThroughputTest(EsmondTest):
-    def __init__(self, archive_url, source, destination, runtime=None):
+    event_type = "throughput"
+    backfill_events = ("throughput",)
+    poll_events     = ("throughput",)
+
+    def __init__(self, archive_url, source, destination, runtime=None, watermarks=None, writer=None, ingest="all", series_cache=None,
+                 resolution=None, adaptive=True):
         
         self.src = source
         self.dst = destination
         
         
         query = EsmondQuery(archive_url, event_type="throughput", source=source, destination=destination)
-        EsmondTest.__init__(self, query, runtime=runtime)
+        EsmondTest.__init__(self, query, runtime=runtime, watermarks=watermarks, writer=writer, ingest=ingest,
+                            series_cache=series_cache, resolution=resolution, adaptive=adaptive)
         
         self.pull(latest=True)
 
@@ -185,88 +399,152 @@ class ThroughputTest(EsmondTest):
 
     def fetch(self, time_range=None, upload=False): 
         
-        if self.archive[0] is None:
-            print("Return bad thread") 
-            return
+        self.upload = upload
 
-        if len(self.archive) == 0:
+        self.pull(latest=True)
+        if len(self.archive) == 0 or self.archive[0] is None:
             print("No tests found for query")
             return 
-        
-        data = self.fetch_data('throughput', time_range=time_range)
 
-        if upload:
-            try: 
-                self.upload_data(data[-1], self.src, self.dst, event_type="throughput")
-            except Exception as e:
-                print("Exception: ", e)
-                logging.info("Could not upload data for throughput | src: %s, dst: %s")
+        if not self.has_new('throughput'):
+            logging.info("No new throughput results for %s -> %s", self.src, self.dst)
+            return []
+        
+        updated = self.updated('throughput')
+        since = self.since('throughput', time_range)
+        data = self.fetch_data('throughput', time_range=time_range, since=since,
+                               summary=self.summary_window('throughput', self.span(since, time_range)))
+        self.fetched('throughput', updated)
+        self.handle_throughput(data)
 
         return data
 
+    def handle_throughput(self, data):
+
+        if not data or not self.upload:
+            return
+
+        if self.upload_points(data, self.src, self.dst, event_type="throughput") is None:
+            logging.info("Could not upload data for throughput | src: %s, dst: %s", self.src, self.dst)
+
 class HistogramOWDelayTest(EsmondTest):
-    def __init__(self, archive_url, source, destination, runtime=None, summary=300):
+    event_type = "histogram-owdelay"
+    backfill_events = ("histogram-owdelay", "packet-count-lost")
+    poll_events     = ("histogram-owdelay", "packet-count-lost")
+    upload_events   = {"packet-count-lost": "packet-count-loss"}
+
+    def __init__(self, archive_url, source, destination, runtime=None, summary=None, watermarks=None, writer=None, ingest="all",
+                 percentiles=(50, 95, 99), series_cache=None, resolution=None, adaptive=True):
         self.src = source
         self.dst = destination
+        self.percentiles = percentiles
         
         query = EsmondQuery(archive_url, event_type="histogram-owdelay", source=source, destination=destination)
-        EsmondTest.__init__(self, query, runtime=runtime)
+        EsmondTest.__init__(self, query, runtime=runtime, watermarks=watermarks, writer=writer, ingest=ingest,
+                            series_cache=series_cache, summary=summary, resolution=resolution, adaptive=adaptive)
         self.pull(latest=True)
     
     def fetch(self, time_range=None, upload=False): 
         
         self.upload = upload
 
-        if len(self.archive) == 0:
+        self.pull(latest=True)
+        if len(self.archive) == 0 or self.archive[0] is None:
             print("No tests found for query")
             return
         
-        data = self.fetch_data("histogram-owdelay", summary=300, time_range=time_range)
-        self.handle_histogram_owdelay(data)
+        data = []
+        if self.has_new("histogram-owdelay"):
+            updated = self.updated("histogram-owdelay")
+            since = self.since("histogram-owdelay", time_range)
+            data = self.fetch_data("histogram-owdelay", time_range=time_range, since=since,
+                                   summary=self.summary_window("histogram-owdelay", self.span(since, time_range)))
+            self.fetched("histogram-owdelay", updated)
+            self.handle_histogram_owdelay(data)
         
-        data = self.fetch_data("packet-count-lost")
-        self.handle_packet_count_loss(data)
+        if self.has_new("packet-count-lost"):
+            updated = self.updated("packet-count-lost")
+            loss = self.fetch_data("packet-count-lost", time_range=time_range, since=self.since("packet-count-lost", time_range))
+            self.fetched("packet-count-lost", updated)
+            self.handle_packet_count_loss(loss)
+
+        return data
 
     def handle_packet_count_loss(self, data):
 
-        if len(data) > 1 and type(data) is list:
-            data = data[-1]
-        elif len(data) == 1:
-            data = data[0]
+        if not data or not self.upload:
+            return
+
+        if type(data) is not list:
+            data = [data]
         
-        if self.upload:
-            try:
-                self.upload_data(data, self.src, self.dst, event_type="packet-count-loss")
-            except:
-                logging.info("Could not upload data for packet-loss-count | src %s, dst: %s", self.src,self.dst)
+        if self.upload_points(data, self.src, self.dst, event_type="packet-count-loss", mark_event="packet-count-lost") is None:
+            logging.info("Could not upload data for packet-loss-count | src %s, dst: %s", self.src,self.dst)
 
     def handle_histogram_owdelay(self, data):
+        '''
+            Reduces every unseen histogram to mean, min, max, stddev and the configured percentiles and
+            uploads each statistic as its own eventType: histogram-owdelay for the mean, and
+            histogram-owdelay-<stat> (eg. histogram-owdelay-p99) for the others.
+            returns - {"val": <mean>, "ts": <ts>} for the newest histogram, or None.
+        '''
 
-        if len(data) > 1 and type(data) is list:
-            data = data[-1]
-        elif type(data) is list and len(data) == 1:
-            data = data[0]
-        else:
-            data = data 
-        
-        temp_total = 0
-        packet_total = 0
-        for k, v in data['val'].items():
-            temp_total = temp_total + (float(k) * v)
-            packet_total = packet_total + int(v)
+        data = self.unseen("histogram-owdelay", data)
+        if not data:
+            return
 
-        avg = temp_total / packet_total
+        if type(data) is not list:
+            data = [data]
+        if self.ingest == "latest":
+            data = data[-1:]
+        
+        ts, stats, valid = self.reduce(data)
+        if not valid.any():
+            return
         
-        res = {"val": avg, "ts":data["ts"]}
         if self.upload:
-            try:
-                self.upload_data(res, self.src, self.dst, event_type="histogram-owdelay")
-            except:
+            if self.write_stats(ts[valid], {name: values[valid] for name, values in stats.items()}):
+                self.advance("histogram-owdelay", int(ts[valid].max()))
+            else:
                 logging.info("Could not upload data for histogram-owdelay | src: %s, dst: %s", self.src, self.dst)
-        return res
+
+        last = np.flatnonzero(valid)[-1]
+        return {"val": float(stats['mean'][last]), "ts": int(ts[last])}
+
+    def reduce(self, data):
+        '''
+            returns - (ts, stats, valid) arrays for a list of histogram points, see reduce_histograms.
+            @valid is False for empty histograms.
+        '''
+        stats = reduce_histograms([hist['val'] for hist in data], percentiles=self.percentiles)
+        ts    = np.fromiter((hist['ts'] for hist in data), dtype=np.int64, count=len(data))
+        return ts, stats, ~np.isnan(stats['mean'])
+
+    def write_stats(self, ts, stats):
+        '''
+            Writes each statistic in @stats to its own eventType, see handle_histogram_owdelay.
+            returns - True if every statistic was written.
+        '''
+        ok = True
+        for name, values in stats.items():
+            event_type = "histogram-owdelay" if name == "mean" else "histogram-owdelay-" + name
+            ok = self.write_columns(ts, values, self.src, self.dst, event_type) and ok
+        return ok
+
+    def write_batch(self, event_type, data):
+        if event_type != "histogram-owdelay":
+            return EsmondTest.write_batch(self, event_type, data)
+
+        ts, stats, valid = self.reduce(data)
+        if not valid.any():
+            return 0
+        if not self.write_stats(ts[valid], {name: values[valid] for name, values in stats.items()}):
+            return None
+        return int(valid.sum())
 
 if __name__ == "__main__":
     rt = Runtime("http://iu-ps01.osris.org:8888")
+    rt.addService("unis.services.data.DataService")
     throughput = ThroughputTest("http://iu-ps01.osris.org", source="192.168.10.202", destination="192.168.10.204", runtime=rt)
     data = throughput.fetch(time_range=3600, upload=True)
 
@@ -0,0 +1,68 @@
+from itertools import chain
+
+import numpy as np
+'''
+    Batch reduction of Esmond histograms.
+
+    Esmond histogram events (histogram-owdelay, histogram-rtt, ...) carry a {bucket: count} dict per
+    point, with the bucket values as strings. reduce_histograms flattens a whole batch of them into
+    value/count arrays and computes the summary statistics for every histogram at once.
+'''
+
+def reduce_histograms(histograms, percentiles=(50, 95, 99)):
+    '''
+        param: histograms - list of {bucket value (str or number): count} dicts.
+        param: percentiles - percentiles to compute, using the nearest-rank method over the buckets.
+
+        returns - dict of statistic name -> float64 array with one entry per histogram. Names are
+                  "mean", "min", "max", "stddev" and "p<q>" for every q in @percentiles.
+                  Histograms without any counts get NaN for every statistic.
+    '''
+    n       = len(histograms)
+    sizes   = np.fromiter((len(h) for h in histograms), dtype=np.int64, count=n)
+    total   = int(sizes.sum())
+
+    keys    = np.array(list(chain.from_iterable(h.keys() for h in histograms)), dtype=np.float64)
+    counts  = np.fromiter(chain.from_iterable(h.values() for h in histograms), dtype=np.float64, count=total)
+    group   = np.repeat(np.arange(n), sizes)
+
+    used            = counts > 0
+    keys, counts    = keys[used], counts[used]
+    group           = group[used]
+    order           = np.lexsort((keys, group))
+    keys, counts    = keys[order], counts[order]
+    group           = group[order]
+
+    sizes   = np.bincount(group, minlength=n)
+    ends    = np.cumsum(sizes)
+    starts  = ends - sizes
+    valid   = sizes > 0
+    first   = np.minimum(starts, max(len(keys) - 1, 0))
+    last    = np.maximum(ends - 1, 0)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        totals  = np.bincount(group, weights=counts, minlength=n)
+        mean    = np.bincount(group, weights=keys * counts, minlength=n) / totals
+        var     = np.bincount(group, weights=counts * (keys - mean[group]) ** 2, minlength=n) / totals
+
+    stats = { "mean":   mean,
+              "stddev": np.sqrt(var),
+              "min":    _take(keys, first, valid),
+              "max":    _take(keys, last, valid) }
+
+    cum     = np.cumsum(counts)
+    offset  = cum[first] - counts[first] if len(keys) else np.zeros(n)
+    for q in percentiles:
+        rank = np.maximum(np.ceil(totals * q / 100.0), 1)
+        idx  = np.searchsorted(cum, offset + rank, side='left') if len(keys) else first
+        stats["p" + _label(q)] = _take(keys, np.clip(idx, first, last), valid)
+
+    return stats
+
+def _take(values, idx, valid):
+    out = np.full(len(idx), np.nan)
+    out[valid] = values[idx[valid]]
+    return out
+
+def _label(q):
+    return str(int(q)) if float(q).is_integer() else str(q)
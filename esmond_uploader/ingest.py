@@ -0,0 +1,26 @@
+import numpy as np
+'''
+    Columnar ingest helpers.
+
+    Esmond returns a JSON list of {"ts": ..., "val": ...} points. These helpers turn such a list into
+    timestamp and value arrays in a single pass so filtering and hand-off to the UNIS writer work on
+    whole batches instead of one Python dict at a time.
+'''
+
+POINT = np.dtype([('ts', np.int64), ('val', np.float64)])
+
+def columns(points, value_key="val"):
+    '''
+        Converts a list of point dicts into a structured array with 'ts' and 'val' columns.
+    '''
+    return np.fromiter(((p['ts'], p[value_key]) for p in points), dtype=POINT, count=len(points))
+
+def newer_than(batch, mark):
+    '''
+        The rows of @batch with a timestamp strictly after @mark, in timestamp order.
+    '''
+    if mark is not None:
+        batch = batch[batch['ts'] > mark]
+    if len(batch) > 1 and not np.all(batch['ts'][1:] >= batch['ts'][:-1]):
+        batch = np.sort(batch, order='ts')
+    return batch
@@ -0,0 +1,170 @@
+import codecs
+import json
+'''
+    Incremental parsing of JSON array responses.
+
+    Esmond answers listings and data queries with one JSON array. Instead of buffering the whole
+    body and building the full list with response.json(), items() parses a streamed response and
+    yields the array elements one at a time, so callers can hand them on in batches and hold at most
+    one chunk of the body plus one batch in memory. ijson is used when it is installed (with its C
+    backend if available); otherwise a pure Python parser built on json.JSONDecoder is used.
+
+    Both parsers fail the same way: a body that is not one complete JSON array raises ValueError, and
+    errors reading the body are raised by the http client, eg. as requests exceptions.
+'''
+
+try:
+    import ijson
+    BACKEND = "ijson/" + ijson.backend
+except ImportError:
+    ijson = None
+    BACKEND = "json"
+
+CHUNK_SIZE = 1 << 16
+
+class ArrayParser:
+    '''
+        Push parser for a top-level JSON array. feed() takes text, or UTF-8 bytes, as it arrives and
+        returns the elements it completed.
+    '''
+    def __init__(self):
+        self._decoder   = json.JSONDecoder()
+        self._utf8      = codecs.getincrementaldecoder("utf-8")()
+        self._buffer    = ""
+        self._started   = False
+        self._separated = True
+        self._done      = False
+        self._retry_at  = 0
+
+        return
+
+    def feed(self, text, final=False):
+        if isinstance(text, bytes):
+            text = self._utf8.decode(text, final=final)
+        self._buffer += text
+        buf, items, pos = self._buffer, [], 0
+        if len(buf) < self._retry_at and not final:
+            return items
+
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n":
+                pos += 1
+            if pos == len(buf):
+                break
+
+            c = buf[pos]
+            if self._done:
+                raise ValueError("extra data after JSON array")
+            if not self._started:
+                if c != "[":
+                    raise ValueError("expected a JSON array")
+                self._started = True
+                pos += 1
+            elif c == "]":
+                self._done = True
+                pos += 1
+            elif not self._separated:
+                if c != ",":
+                    raise ValueError("expected ',' or ']' in JSON array")
+                self._separated = True
+                pos += 1
+            else:
+                try:
+                    item, end = self._decoder.raw_decode(buf, pos)
+                except ValueError:
+                    if final:
+                        raise
+                    break
+                # a number cut by the end of the text may continue in the next chunk, eg. "2." + "5"
+                if not final and (end == len(buf) or (c not in '{["' and buf[end] not in " \t\r\n,]")):
+                    break
+                items.append(item)
+                self._separated = False
+                pos = end
+
+        self._buffer = buf[pos:]
+        # an element split across chunks is parsed again only once the pending text has doubled
+        self._retry_at = 2 * len(self._buffer)
+        if final and not self._done:
+            raise ValueError("truncated JSON array")
+        return items
+
+class IjsonArrayParser:
+    '''
+        ArrayParser on top of ijson. feed() takes UTF-8 bytes.
+    '''
+    def __init__(self):
+        self._items     = ijson.sendable_list()
+        self._coro      = ijson.items_coro(self._items, "item", use_float=True)
+        self._started   = False
+
+        return
+
+    def feed(self, data, final=False):
+        if not self._started and data.strip():
+            # ijson yields nothing for a valid document that is not an array
+            if data.lstrip()[:1] != b"[":
+                raise ValueError("expected a JSON array")
+            self._started = True
+
+        try:
+            if data:
+                self._coro.send(data)
+            if final:
+                if not self._started:
+                    raise ValueError("truncated JSON array")
+                self._coro.close()
+        except ijson.JSONError as e:
+            raise ValueError(str(e).strip())
+
+        items = list(self._items)
+        del self._items[:]
+        return items
+
+def parser():
+    '''
+        A new push parser for one response body, using ijson when it is installed.
+    '''
+    return IjsonArrayParser() if ijson is not None else ArrayParser()
+
+def items(response, chunk_size=CHUNK_SIZE):
+    '''
+        Yields the elements of the JSON array in the body of @response, a requests response fetched
+        with stream=True.
+    '''
+    array = parser()
+    for chunk in response.iter_content(chunk_size):
+        for item in array.feed(chunk):
+            yield item
+    for item in array.feed(b"", final=True):
+        yield item
+
+async def aitems(response, chunk_size=CHUNK_SIZE):
+    '''
+        Async version of items() for an aiohttp response.
+    '''
+    array = parser()
+    async for chunk in response.content.iter_chunked(chunk_size):
+        for item in array.feed(chunk):
+            yield item
+    for item in array.feed(b"", final=True):
+        yield item
+
+def load(response):
+    '''
+        The whole array in @response as a list, see items().
+    '''
+    return list(items(response))
+
+def batches(iterable, size):
+    '''
+        Yields lists of up to @size consecutive elements of @iterable.
+    '''
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
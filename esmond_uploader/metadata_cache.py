@@ -0,0 +1,174 @@
+import logging
+import threading
+import time
+
+import requests
+
+from sessions import get_session
+import jsonstream
+'''
+    Cache of Esmond archive listings.
+
+    Tests look up their archive entries here instead of querying /esmond/perfsonar/archive/ on every
+    fetch. Entries are keyed on the listing url built from the EsmondQuery parameters, expire after a
+    TTL, are revalidated with ETag/Last-Modified when the archive provides them, and are refreshed
+    ahead of expiry by a background thread so data fetches do not wait on the listing.
+'''
+
+def latest_entry(archive):
+    '''
+        The most recently updated archive entry in a listing, judged by the first event's time-updated.
+        returns - <archive entry dict>, or None for an empty listing.
+    '''
+    latest = None
+    for a in archive:
+        if latest is None:
+            latest = a
+        elif a['event-types'][0]['time-updated'] and \
+             a['event-types'][0]['time-updated'] > (latest['event-types'][0]['time-updated'] or 0):
+            latest = a
+    return latest
+
+def event_map(entry):
+    '''
+        Maps event-type -> event dict (base-uri, summaries, time-updated) for an archive entry.
+    '''
+    if entry is None:
+        return {}
+    return {event['event-type']: event for event in entry['event-types']}
+
+class ArchiveListing:
+    def __init__(self, url, archive, etag=None, modified=None, managed=False):
+        self.url        = url
+        self.managed    = managed
+        self.archive    = archive
+        self.latest     = latest_entry(archive)
+        self.events     = event_map(self.latest)
+        self.etag       = etag
+        self.modified   = modified
+        self.fetched    = time.time()
+        self.used       = self.fetched
+
+class ArchiveMetadataCache:
+    '''
+        param: ttl - seconds a listing is served before it must be revalidated.
+        param: refresh_ahead - fraction of @ttl after which the background thread refreshes a listing.
+    '''
+    def __init__(self, ttl=300, refresh_ahead=0.75):
+        self.ttl            = ttl
+        self.refresh_ahead  = refresh_ahead
+        self.hits           = 0
+        self.misses         = 0
+        self.revalidated    = 0
+        self._listings      = {}
+        self._lock          = threading.Lock()
+        self._thread        = None
+
+        return
+
+    def lookup(self, url):
+        '''
+            The cached listing for @url if it has not expired, else None.
+        '''
+        with self._lock:
+            listing = self._listings.get(url)
+            if listing is None or time.time() - listing.fetched > self.ttl:
+                return None
+            listing.used = time.time()
+            self.hits += 1
+            return listing
+
+    def get(self, url):
+        '''
+            The listing for @url, fetching it from the archive on a miss or after expiry.
+        '''
+        listing = self.lookup(url)
+        if listing is None:
+            self.misses += 1
+            listing = self.refresh(url)
+        return listing
+
+    def put(self, url, archive, etag=None, modified=None, managed=False):
+        '''
+            Store a listing for @url. Managed listings are kept fresh by whoever put them (see discovery)
+            and are skipped by the background refresh.
+        '''
+        listing = ArchiveListing(url, archive, etag=etag, modified=modified, managed=managed)
+        with self._lock:
+            self._listings[url] = listing
+        return listing
+
+    def refresh(self, url):
+        '''
+            Revalidate or refetch the listing for @url.
+        '''
+        with self._lock:
+            current = self._listings.get(url)
+
+        headers = {}
+        if current is not None and current.etag:
+            headers['If-None-Match'] = current.etag
+        if current is not None and current.modified:
+            headers['If-Modified-Since'] = current.modified
+
+        try:
+            with get_session().get(url, headers=headers, stream=True) as response:
+                if response.status_code == 304 and current is not None:
+                    with self._lock:
+                        current.fetched = time.time()
+                        self.revalidated += 1
+                    return current
+                response.raise_for_status()
+                archive = jsonstream.load(response)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            if current is not None:
+                logging.info("Could not refresh archive listing %s, keeping cached copy | %s", url, e)
+                return current
+            raise AttributeError(e)
+
+        listing = self.put(url, archive, etag=response.headers.get('ETag'),
+                           modified=response.headers.get('Last-Modified'))
+        if current is not None:
+            listing.used = current.used
+        return listing
+
+    def start(self):
+        self._thread = threading.Thread(target=self._refresh_loop, name="metadata-cache", daemon=True)
+        self._thread.start()
+
+        return
+
+    def _refresh_loop(self):
+        while True:
+            time.sleep(max(1, self.ttl * (1 - self.refresh_ahead) / 2))
+
+            now = time.time()
+            with self._lock:
+                # Listings nobody read for two TTLs belong to retired tests, let them expire
+                stale = [url for url, l in self._listings.items() if not l.managed
+                         and now - l.fetched > self.ttl * self.refresh_ahead and now - l.used < 2 * self.ttl]
+
+            for url in stale:
+                try:
+                    self.refresh(url)
+                except Exception as e:
+                    logging.info("Background refresh failed for %s | %s", url, e)
+
+_cache  = None
+_lock   = threading.Lock()
+
+def configure(**kwargs):
+    '''
+        Replace the shared cache with one built from @kwargs, see ArchiveMetadataCache.
+    '''
+    global _cache
+    with _lock:
+        _cache = ArchiveMetadataCache(**kwargs)
+    return _cache
+
+def get_cache():
+    global _cache
+    with _lock:
+        if _cache is None:
+            _cache = ArchiveMetadataCache()
+        return _cache
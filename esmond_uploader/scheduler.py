@@ -0,0 +1,144 @@
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+'''
+    Central scheduler for periodic test fetches.
+
+    Instead of one thread per (source, destination) pair, every pair is registered here as a task
+    with an interval. The scheduler keeps a priority queue of next-due tasks and hands due tasks to
+    a fixed size worker pool, so thread count does not grow with the mesh.
+'''
+
+class ScheduledTask:
+    def __init__(self, key, func, interval):
+        self.key        = key
+        self.func       = func
+        self.interval   = interval
+        self.due        = None
+        self.running    = False
+        self.retired    = False
+
+class TestScheduler:
+    '''
+        Runs periodic tasks on a bounded worker pool.
+
+        param: workers - size of the worker pool.
+        param: jitter - fraction of a task's interval used to randomly spread its deadlines.
+
+        A task function is called with no arguments. Returning False retires the task, returning a
+        number runs it again that many seconds after it finished, and anything else reschedules it one
+        interval (+/- jitter) after it finished. A task is never queued again while it is still running.
+    '''
+    def __init__(self, workers=8, jitter=0.1):
+        self.workers    = workers
+        self.jitter     = jitter
+        self._heap      = []
+        self._tasks     = {}
+        self._counter   = itertools.count()
+        self._cond      = threading.Condition()
+        self._pool      = ThreadPoolExecutor(max_workers=workers)
+        self._thread    = None
+        self._stopped   = False
+
+        return
+
+    def add(self, key, func, interval, delay=None):
+        '''
+            Register a periodic task under @key. The first run is spread uniformly over one interval
+            unless @delay is given, so a large mesh does not fire all at once on startup.
+        '''
+        task = ScheduledTask(key, func, interval)
+        delay = random.uniform(0, interval) if delay is None else delay
+
+        with self._cond:
+            old = self._tasks.get(key)
+            if old is not None:
+                old.retired = True
+            self._tasks[key] = task
+            self._push(task, time.time() + delay)
+
+        return task
+
+    def remove(self, key):
+        '''
+            Retire the task under @key. A run already in progress finishes but is not rescheduled.
+        '''
+        with self._cond:
+            task = self._tasks.pop(key, None)
+            if task is not None:
+                task.retired = True
+                self._cond.notify()
+
+        return task
+
+    def keys(self):
+        with self._cond:
+            return list(self._tasks.keys())
+
+    def start(self):
+        self._thread = threading.Thread(target=self._dispatch, name="scheduler")
+        self._thread.start()
+
+        return
+
+    def stop(self, wait=True):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        self._pool.shutdown(wait=wait)
+
+        return
+
+    def _push(self, task, due):
+        task.due = due
+        heapq.heappush(self._heap, (due, next(self._counter), task))
+        self._cond.notify()
+
+    def _spread(self, interval):
+        return interval + random.uniform(-self.jitter, self.jitter) * interval
+
+    def _dispatch(self):
+        while True:
+            with self._cond:
+                while not self._stopped:
+                    if self._heap and self._heap[0][0] <= time.time():
+                        break
+                    timeout = (self._heap[0][0] - time.time()) if self._heap else None
+                    self._cond.wait(timeout)
+
+                if self._stopped:
+                    return
+
+                due, _, task = heapq.heappop(self._heap)
+                if task.retired or task.due != due:
+                    continue
+                task.running = True
+
+            self._pool.submit(self._run, task)
+
+    def _run(self, task):
+        result = None
+        try:
+            result = task.func()
+        except Exception:
+            logging.exception("Scheduled task %s failed", task.key)
+
+        with self._cond:
+            task.running = False
+            if task.retired:
+                return
+            if result is False:
+                logging.info("Retiring task %s", task.key)
+                if self._tasks.get(task.key) is task:
+                    del self._tasks[task.key]
+                task.retired = True
+                return
+            if isinstance(result, (int, float)) and not isinstance(result, bool):
+                self._push(task, time.time() + result)
+            else:
+                self._push(task, time.time() + self._spread(task.interval))
@@ -0,0 +1,181 @@
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+'''
+    Local durable cache of Esmond time series.
+
+    Points fetched from the archive are appended on disk per (archive metadata-key, event type), split
+    into time partitions of JSON lines, together with the time range the cache is known to hold
+    completely. Partitions are only rewritten to drop duplicate points once they make up half of it. A fetch
+    for a range that is covered is answered from disk; otherwise only the missing edges are requested
+    from Esmond. Whole series are evicted, least recently used first, when the cache grows past its
+    size limit.
+'''
+
+class SeriesCache:
+    '''
+        param: root - directory holding the cache.
+        param: partition - partition length in seconds.
+        param: max_bytes - size limit for the whole cache.
+        param: settle - seconds before now that a range is treated as complete. Esmond results can
+               arrive late, so the newest @settle seconds are always fetched again.
+    '''
+    def __init__(self, root, partition=86400, max_bytes=512 * 1024 * 1024, settle=300):
+        self.root       = root
+        self.partition  = partition
+        self.max_bytes  = max_bytes
+        self.settle     = settle
+        self.hits       = 0
+        self.fetched    = 0
+        self._locks     = {}
+        self._lock      = threading.Lock()
+
+        os.makedirs(root, exist_ok=True)
+        self.size       = self._disk_usage()
+
+        return
+
+    def get(self, key, event_type, start, end, fetch):
+        '''
+            Points of series (@key, @event_type) with @start <= ts <= @end, in timestamp order.
+            @fetch(start, end) is called for every range that is not cached and must return the
+            Esmond points for it.
+        '''
+        for a, b in self.missing(key, event_type, start, end):
+            self.store(key, event_type, fetch(a, b), a, b)
+        return self.read(key, event_type, start, end)
+
+    def missing(self, key, event_type, start, end):
+        '''
+            The (start, end) ranges of [@start, @end] that have to be fetched from the archive.
+        '''
+        with self._series_lock(key, event_type):
+            cov = self._coverage(key, event_type)
+
+        if cov is None or end < cov[0] or start > cov[1]:
+            return [(start, end)]
+
+        ranges = []
+        if start < cov[0]:
+            ranges.append((start, cov[0] - 1))
+        if end > cov[1]:
+            ranges.append((cov[1] + 1, end))
+        if not ranges:
+            self.hits += 1
+        return ranges
+
+    def store(self, key, event_type, points, start, end):
+        '''
+            Add @points fetched for [@start, @end] and extend the covered range with it.
+        '''
+        self.fetched += len(points)
+        with self._series_lock(key, event_type):
+            parts = {}
+            for p in points:
+                parts.setdefault(p['ts'] - p['ts'] % self.partition, []).append(p)
+            for pstart, new in parts.items():
+                self._append(os.path.join(self._dir(key, event_type), "%d.jsonl" % pstart), new)
+
+            end = min(end, int(time.time()) - self.settle)
+            cov = self._coverage(key, event_type)
+            if end < start:
+                pass
+            elif cov is None or end + 1 < cov[0] or start > cov[1] + 1:
+                self._write_coverage(key, event_type, [start, end])
+            else:
+                self._write_coverage(key, event_type, [min(start, cov[0]), max(end, cov[1])])
+
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def read(self, key, event_type, start, end):
+        with self._series_lock(key, event_type):
+            directory = self._dir(key, event_type)
+            points = []
+            pstart = start - start % self.partition
+            while pstart <= end:
+                points.extend(p for p in self._load(os.path.join(directory, "%d.jsonl" % pstart))
+                              if start <= p['ts'] <= end)
+                pstart += self.partition
+            if os.path.isdir(directory):
+                os.utime(directory)
+        return points
+
+    def evict(self):
+        '''
+            Remove whole series, least recently read first, until the cache is below its size limit.
+        '''
+        series = []
+        for key in os.listdir(self.root):
+            for event_type in os.listdir(os.path.join(self.root, key)):
+                directory = os.path.join(self.root, key, event_type)
+                series.append((os.path.getmtime(directory), key, event_type, directory))
+
+        for mtime, key, event_type, directory in sorted(series):
+            if self.size <= self.max_bytes * 0.9:
+                break
+            with self._series_lock(key, event_type):
+                freed = self._dir_size(directory)
+                shutil.rmtree(directory, ignore_errors=True)
+            with self._lock:
+                self.size -= freed
+            logging.info("Evicted cached series %s/%s, %s bytes", key, event_type, freed)
+
+    def _series_lock(self, key, event_type):
+        with self._lock:
+            return self._locks.setdefault((key, event_type), threading.RLock())
+
+    def _dir(self, key, event_type):
+        return os.path.join(self.root, key.replace("/", "_"), event_type)
+
+    def _coverage(self, key, event_type):
+        path = os.path.join(self._dir(key, event_type), "coverage.json")
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def _write_coverage(self, key, event_type, cov):
+        self._write(os.path.join(self._dir(key, event_type), "coverage.json"), json.dumps(cov))
+
+    def _append(self, path, points):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = "".join(json.dumps(p) + "\n" for p in points)
+        with open(path, "a") as f:
+            f.write(data)
+        with self._lock:
+            self.size += len(data)
+
+    def _load(self, path):
+        '''
+            The points of a partition in timestamp order, the last stored point winning for every timestamp.
+        '''
+        if not os.path.exists(path):
+            return []
+        with open(path) as f:
+            lines = [json.loads(line) for line in f if line.strip()]
+        points = {p['ts']: p for p in lines}
+        result = [points[ts] for ts in sorted(points)]
+        if len(lines) > 2 * len(result):
+            self._write(path, "".join(json.dumps(p) + "\n" for p in result))
+        return result
+
+    def _write(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        old = os.path.getsize(path) if os.path.exists(path) else 0
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(data)
+        new = os.path.getsize(tmp)
+        os.replace(tmp, path)
+        with self._lock:
+            self.size += new - old
+
+    def _dir_size(self, directory):
+        return sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(directory) for f in files)
+
+    def _disk_usage(self):
+        return self._dir_size(self.root)
@@ -0,0 +1,257 @@
+import contextlib
+import logging
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+from breaker import CircuitBreaker, TokenBucket
+'''
+    Shared HTTP session layer.
+
+    Every archive and UNIS request made by the uploader goes through the ArchiveSession returned by
+    get_session(), so connections to each host are pooled and kept alive instead of being reopened
+    for every call. Call configure() once at startup to change pool size, retries or timeouts.
+
+    Each host also gets a circuit breaker and a token bucket: requests to a host that keeps failing
+    are refused immediately with CircuitOpenError until a probe succeeds, and requests beyond the
+    host's rate wait for a token. Code running under deadline() has every request's timeout cut to
+    the time left, and gets DeadlineExceeded instead of starting a request it cannot finish.
+'''
+
+RETRY_STATUS    = (500, 502, 503, 504)
+RETRY_METHODS   = frozenset(["HEAD", "GET", "PUT", "DELETE", "OPTIONS", "TRACE"])
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    pass
+
+class DeadlineExceeded(requests.exceptions.Timeout):
+    pass
+
+class Endpoint:
+    '''
+        Breaker and rate limit of a single host, see ArchiveSession.
+    '''
+    def __init__(self, host, rate=20, burst=None, failures=5, reset=30, ramp=60):
+        self.host       = host
+        self.breaker    = CircuitBreaker(failures=failures, reset=reset, ramp=ramp)
+        self.bucket     = TokenBucket(rate, burst) if rate else None
+        self.refused    = 0
+
+        return
+
+    def admit(self, deadline=None):
+        '''
+            Waits for this host's rate limit and returns once a request may be sent.
+            Raises CircuitOpenError while the circuit is open and DeadlineExceeded if the wait would pass @deadline.
+        '''
+        wait = self.reserve(deadline)
+        if wait > 0:
+            time.sleep(wait)
+
+    def reserve(self, deadline=None):
+        '''
+            Non-blocking part of admit().
+            returns - seconds the caller must wait before sending.
+        '''
+        if not self.breaker.allow():
+            self.refused += 1
+            raise CircuitOpenError("circuit open for " + self.host)
+        wait = self.bucket.reserve(self.breaker.ramp()) if self.bucket is not None else 0.0
+        if deadline is not None and time.time() + wait >= deadline:
+            if self.bucket is not None:
+                self.bucket.cancel()
+            self.breaker.cancel()
+            raise DeadlineExceeded("deadline passed before request to " + self.host)
+        return wait
+
+    def record(self, status=None):
+        '''
+            Feeds the outcome of a request to the breaker: an HTTP @status, or None for a request that
+            raised. 5xx and 429 responses count as failures.
+        '''
+        if status is None or status >= 500 or status == 429:
+            self.breaker.failure()
+        else:
+            self.breaker.success()
+
+_local = threading.local()
+
+@contextlib.contextmanager
+def deadline(seconds):
+    '''
+        Requests made by this thread inside the block must finish within @seconds.
+        Nested blocks keep the earlier deadline.
+    '''
+    previous = getattr(_local, 'deadline', None)
+    at = time.time() + seconds
+    _local.deadline = at if previous is None else min(previous, at)
+    try:
+        yield
+    finally:
+        _local.deadline = previous
+
+def current_deadline():
+    return getattr(_local, 'deadline', None)
+
+class ArchiveSession:
+    '''
+        Thread-safe wrapper around a requests.Session with per-host connection pools.
+
+        param: pool_size - number of kept-alive connections per host.
+        param: hosts - number of host pools kept open.
+        param: retries - number of retries on connection errors, read timeouts and 5xx responses for
+               idempotent methods. Other methods are only retried when the connection could not be made.
+               Every retry waits for the host's rate limit and breaker.
+        param: backoff - a retry waits @backoff * 2^n seconds, n counting from 0.
+        param: timeout - default (connect, read) timeout in seconds for every request.
+        param: rate, burst - token bucket per host, in requests per second; 0 turns rate limiting off.
+        param: failures, reset, ramp - circuit breaker per host, see CircuitBreaker.
+    '''
+    def __init__(self, pool_size=10, hosts=32, retries=3, backoff=0.5, timeout=(5, 60),
+                 rate=20, burst=None, failures=5, reset=30, ramp=60):
+        self.pool_size  = pool_size
+        self.retries    = retries
+        self.backoff    = backoff
+        self.timeout    = timeout
+        self.limits     = {'rate': rate, 'burst': burst, 'failures': failures, 'reset': reset, 'ramp': ramp}
+        self.endpoints  = {}
+        self._lock      = threading.Lock()
+
+        # retries are made in request(), so each attempt is rate limited, seen by the breaker and clipped to the deadline
+        self.adapter    = HTTPAdapter(pool_connections=hosts, pool_maxsize=pool_size,
+                                      max_retries=0, pool_block=False)
+        self.session    = requests.Session()
+        self.session.mount("http://", self.adapter)
+        self.session.mount("https://", self.adapter)
+
+        return
+
+    def endpoint(self, url):
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in self.endpoints:
+                self.endpoints[host] = Endpoint(host, **self.limits)
+            return self.endpoints[host]
+
+    def request(self, method, url, **kwargs):
+        '''
+            Sends a request, retrying as described for @retries. A retry that cannot start before the
+            deadline is not made; the last response or error is returned or raised instead.
+        '''
+        endpoint = self.endpoint(url)
+        at = current_deadline()
+        timeout = kwargs.pop('timeout', self.timeout)
+
+        attempt = 0
+        while True:
+            endpoint.admit(at)
+            try:
+                clipped = timeout if at is None else _clip(timeout, at - time.time())
+            except DeadlineExceeded:
+                endpoint.breaker.cancel()
+                raise
+            try:
+                response = self.session.request(method, url, timeout=clipped, **kwargs)
+            except requests.exceptions.RequestException as e:
+                endpoint.record(None)
+                if attempt >= self.retries or not _retryable(method, e):
+                    raise
+                response = None
+            else:
+                endpoint.record(response.status_code)
+                if attempt >= self.retries or response.status_code not in RETRY_STATUS or method.upper() not in RETRY_METHODS:
+                    return response
+
+            wait = self.backoff * 2 ** attempt
+            if at is not None and time.time() + wait >= at:
+                if response is not None:
+                    return response
+                raise DeadlineExceeded("deadline passed before retrying " + url)
+            if response is not None:
+                response.close()
+            time.sleep(wait)
+            attempt += 1
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def stats(self):
+        '''
+            Connection reuse counters summed over all host pools.
+            returns - {'requests': <int>, 'connections': <int>, 'reused': <int>, 'hosts': <int>}
+        '''
+        pools = self.adapter.poolmanager.pools
+        reqs, conns, hosts = 0, 0, 0
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            hosts += 1
+            reqs  += pool.num_requests
+            conns += pool.num_connections
+
+        return {'requests': reqs, 'connections': conns, 'reused': reqs - conns, 'hosts': hosts}
+
+    def breakers(self):
+        '''
+            returns - {host: (breaker state, requests refused)} for every host that is not healthy.
+        '''
+        with self._lock:
+            endpoints = list(self.endpoints.values())
+        return {e.host: (e.breaker.state, e.refused) for e in endpoints if e.breaker.state != CircuitBreaker.CLOSED}
+
+    def close(self):
+        self.session.close()
+
+def _retryable(method, error):
+    '''
+        Idempotent methods are retried on any connection error or timeout. A POST that may have been
+        sent, eg. when the connection dropped before the response, is not, so it cannot be applied twice.
+    '''
+    if isinstance(error, (CircuitOpenError, DeadlineExceeded)):
+        return False
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    if method.upper() in RETRY_METHODS:
+        return isinstance(error, (requests.exceptions.Timeout, requests.exceptions.ConnectionError))
+    return isinstance(error, requests.exceptions.ConnectionError) and _not_connected(error)
+
+def _not_connected(error):
+    cause = error.args[0] if error.args else None
+    return isinstance(getattr(cause, 'reason', cause), NewConnectionError)
+
+def _clip(timeout, remaining):
+    if remaining <= 0:
+        raise DeadlineExceeded("deadline passed")
+    if isinstance(timeout, tuple):
+        return tuple(min(t, remaining) for t in timeout)
+    return min(timeout, remaining) if timeout is not None else remaining
+
+_session    = None
+_lock       = threading.Lock()
+
+def configure(**kwargs):
+    '''
+        Replace the shared session with one built from @kwargs, see ArchiveSession.
+    '''
+    global _session
+    with _lock:
+        if _session is not None:
+            _session.close()
+        _session = ArchiveSession(**kwargs)
+        logging.info("HTTP session pool size %s, timeout %s", _session.pool_size, _session.timeout)
+    return _session
+
+def get_session():
+    global _session
+    with _lock:
+        if _session is None:
+            _session = ArchiveSession()
+        return _session
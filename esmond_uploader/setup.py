@@ -24,8 +24,13 @@ setup(
     ],
     install_requires=[
         "requests",
+        "aiohttp",
+        "numpy",
         "python-daemon"
     ],
+    extras_require={
+        "fast-json": ["ijson"]
+    },
  	entry_points = {
         'console_scripts': [
             'esmond_uploader = app:main'
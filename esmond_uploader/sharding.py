@@ -0,0 +1,112 @@
+import bisect
+import hashlib
+import logging
+import os
+import socket
+import time
+'''
+    Splitting a mesh across worker processes.
+
+    Every (test type, source, destination) pair is owned by exactly one worker, chosen with a
+    consistent hash ring over the live workers. When a worker joins or leaves only the pairs on its
+    part of the ring move, everything else stays where its caches and connections are warm.
+
+    Workers find each other through a membership directory: each one touches a heartbeat file named
+    after its id, and a worker whose file is older than @timeout is treated as gone. Workers on
+    several hosts share the mesh by pointing at the same directory on a shared filesystem.
+'''
+
+class HashRing:
+    '''
+        param: nodes - initial worker ids.
+        param: replicas - points per worker on the ring; more points spread pairs more evenly.
+    '''
+    def __init__(self, nodes=(), replicas=100):
+        self.replicas   = replicas
+        self.nodes      = set()
+        self._points    = []
+        self._owners    = []
+
+        for node in nodes:
+            self.add(node)
+
+        return
+
+    def add(self, node):
+        if node in self.nodes:
+            return
+        self.nodes.add(node)
+        for i in range(self.replicas):
+            point = _hash("%s#%d" % (node, i))
+            at = bisect.bisect(self._points, point)
+            self._points.insert(at, point)
+            self._owners.insert(at, node)
+
+    def remove(self, node):
+        if node not in self.nodes:
+            return
+        self.nodes.discard(node)
+        keep = [(p, o) for p, o in zip(self._points, self._owners) if o != node]
+        self._points = [p for p, o in keep]
+        self._owners = [o for p, o in keep]
+
+    def owner(self, key):
+        '''
+            The worker owning @key, a string or a tuple of strings, or None for an empty ring.
+        '''
+        if not self._points:
+            return None
+        if isinstance(key, tuple):
+            key = "|".join(key)
+        at = bisect.bisect(self._points, _hash(key)) % len(self._points)
+        return self._owners[at]
+
+def _hash(value):
+    return int(hashlib.md5(value.encode("utf-8")).hexdigest()[:16], 16)
+
+class ShardMembership:
+    '''
+        Heartbeat files in @directory, one per live worker.
+
+        param: worker_id - this worker's id. Reusing an id after a restart gives the worker back the same pairs.
+        param: timeout - seconds after its last heartbeat that a worker is considered gone.
+    '''
+    def __init__(self, directory, worker_id, timeout=30):
+        self.directory  = directory
+        self.worker_id  = worker_id
+        self.timeout    = timeout
+
+        os.makedirs(directory, exist_ok=True)
+
+        return
+
+    def heartbeat(self):
+        path = os.path.join(self.directory, self.worker_id)
+        with open(path, "w") as f:
+            f.write("%s %d\n" % (socket.gethostname(), os.getpid()))
+
+    def members(self):
+        '''
+            Ids of the workers with a recent heartbeat, always including this one.
+        '''
+        now = time.time()
+        live = {self.worker_id}
+        for name in os.listdir(self.directory):
+            try:
+                if now - os.path.getmtime(os.path.join(self.directory, name)) <= self.timeout:
+                    live.add(name)
+            except OSError:
+                continue
+        return live
+
+    def leave(self):
+        try:
+            os.remove(os.path.join(self.directory, self.worker_id))
+        except OSError as e:
+            logging.info("Could not remove heartbeat for %s | %s", self.worker_id, e)
+
+def worker_id(index):
+    '''
+        The default id of the @index-th worker started on this host.
+    '''
+    return "%s-%d" % (socket.gethostname(), index)
@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+import requests
+
+import jsonstream
+
+BACKENDS = ["json", "ijson"]
+
+BAD = { "truncated":    b'[{"ts": 1, "val": 2.5}, {"ts": 2, "va',
+        "cut":          b'[{"ts": 1, "val": 2.5}',
+        "empty":        b'',
+        "object":       b'{"ts": 1, "val": 2.5}',
+        "number":       b'42',
+        "garbage":      b'[1, 2] x',
+        "separator":    b'[1 2]',
+        "html":         b'<html>Bad Gateway</html>' }
+
+class Response:
+    '''
+        Stands in for a streamed requests response, handing out @body in @chunk byte pieces and then
+        raising @error if set.
+    '''
+    def __init__(self, body, chunk=3, error=None):
+        self.body   = body
+        self.chunk  = chunk
+        self.error  = error
+
+    def iter_content(self, chunk_size):
+        for i in range(0, len(self.body), self.chunk):
+            yield self.body[i:i + self.chunk]
+        if self.error is not None:
+            raise self.error
+
+class Content:
+    def __init__(self, body, chunk=3):
+        self.body   = body
+        self.chunk  = chunk
+
+    async def iter_chunked(self, chunk_size):
+        for i in range(0, len(self.body), self.chunk):
+            yield self.body[i:i + self.chunk]
+
+class AsyncResponse:
+    def __init__(self, body):
+        self.content = Content(body)
+
+@pytest.fixture(params=BACKENDS)
+def backend(request, monkeypatch):
+    if request.param == "json":
+        monkeypatch.setattr(jsonstream, "ijson", None)
+    elif jsonstream.ijson is None:
+        pytest.skip("ijson is not installed")
+    return request.param
+
+def test_items(backend):
+    body = b' [{"ts": 1, "val": 2.5}, {"ts": 2, "val": {"1.5": 3}}, 7, "\xc3\xa9"] '
+    assert jsonstream.load(Response(body)) == [{"ts": 1, "val": 2.5}, {"ts": 2, "val": {"1.5": 3}}, 7, u"\xe9"]
+    assert jsonstream.load(Response(b"[]")) == []
+
+@pytest.mark.parametrize("name", sorted(BAD))
+def test_bad_body(backend, name):
+    with pytest.raises(ValueError):
+        jsonstream.load(Response(BAD[name]))
+
+@pytest.mark.parametrize("name", sorted(BAD))
+def test_bad_body_async(backend, name):
+    async def load():
+        return [item async for item in jsonstream.aitems(AsyncResponse(BAD[name]))]
+
+    with pytest.raises(ValueError):
+        asyncio.run(load())
+
+def test_transport_error(backend):
+    error = requests.exceptions.ChunkedEncodingError("connection broken")
+    with pytest.raises(requests.exceptions.ChunkedEncodingError):
+        jsonstream.load(Response(b'[1, 2, 3', error=error))
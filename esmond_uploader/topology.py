@@ -0,0 +1,179 @@
+import logging
+import threading
+
+from unis.models import Node
+from unis.services import RuntimeService
+from unis.services.event import new_event, update_event, delete_event
+'''
+    Indexes over the UNIS topology held by a Runtime.
+
+    UnisUtil resolves nodes by management address or name, the edges incident to a node and the link
+    between two nodes on every upload. Scanning rt.nodes or rt.graph.edges for each of those does not
+    scale to large topologies, so TopologyIndex keeps dictionaries for them and TopologyIndexService
+    keeps the dictionaries current from the runtime's change events.
+'''
+
+def _mgmtaddr(node):
+    try:
+        return node.properties.mgmtaddr
+    except AttributeError:
+        return None
+
+def _name(resource):
+    try:
+        return resource.name
+    except AttributeError:
+        return None
+
+class TopologyIndex:
+    '''
+        mgmtaddr -> node, name -> node, name -> link, node -> incident edges and (node, node) -> link.
+
+        Node entries are updated in place on change events. Edge entries are derived from rt.graph and
+        are rebuilt on the next lookup after any node or link change.
+        Callables in @listeners are called with the changed resource after every change event.
+    '''
+    def __init__(self, rt):
+        self.rt             = rt
+        self._lock          = threading.RLock()
+        self.by_addr        = {}
+        self.by_name        = {}
+        self.links_by_name  = {}
+        self._node_keys     = {}
+        self._link_names    = {}
+        self._edges         = {}
+        self._between       = {}
+        self._edges_dirty   = True
+        self.listeners      = []
+
+        for node in rt.nodes:
+            self.add_node(node)
+        for link in rt.links:
+            self.add_link(link)
+
+        return
+
+    def add_node(self, node):
+        with self._lock:
+            if not self._unindex_node(node):
+                self._edges_dirty = True
+            addr, name = _mgmtaddr(node), _name(node)
+            if addr is not None:
+                self.by_addr[addr] = node
+            if name is not None:
+                self.by_name[name] = node
+            self._node_keys[node.id] = (addr, name)
+
+    def remove_node(self, node):
+        with self._lock:
+            self._unindex_node(node)
+            self._edges_dirty = True
+
+    def _unindex_node(self, node):
+        if node.id not in self._node_keys:
+            return False
+        addr, name = self._node_keys.pop(node.id)
+        if self.by_addr.get(addr) is node:
+            del self.by_addr[addr]
+        if self.by_name.get(name) is node:
+            del self.by_name[name]
+        return True
+
+    def add_link(self, link):
+        with self._lock:
+            self.remove_link(link)
+            name = _name(link)
+            if name is not None:
+                self.links_by_name[name] = link
+            self._link_names[link.id] = name
+            self._edges_dirty = True
+
+    def remove_link(self, link):
+        with self._lock:
+            name = self._link_names.pop(link.id, None)
+            if self.links_by_name.get(name) is link:
+                del self.links_by_name[name]
+            self._edges_dirty = True
+
+    def node_by_addr(self, addr):
+        with self._lock:
+            return self.by_addr.get(addr)
+
+    def node_by_name(self, name):
+        with self._lock:
+            return self.by_name.get(name)
+
+    def link_by_name(self, name):
+        with self._lock:
+            return self.links_by_name.get(name)
+
+    def edges(self, *nodes):
+        '''
+            The graph edges incident to any of @nodes, in rt.graph.edges order and without duplicates.
+        '''
+        with self._lock:
+            self._build_edges()
+            found = {}
+            for node in nodes:
+                for pos, edge in self._edges.get(node.id, []):
+                    found[pos] = edge
+            return [found[pos] for pos in sorted(found)]
+
+    def link_between(self, a, b):
+        '''
+            The first graph link joining @a and @b in either direction, or None.
+        '''
+        with self._lock:
+            self._build_edges()
+            return self._between.get((a.id, b.id))
+
+    def _build_edges(self):
+        if not self._edges_dirty:
+            return
+
+        edges, between = {}, {}
+        for pos, e in enumerate(self.rt.graph.edges):
+            edges.setdefault(e[0].id, []).append((pos, e))
+            if e[1].id != e[0].id:
+                edges.setdefault(e[1].id, []).append((pos, e))
+            between.setdefault((e[0].id, e[1].id), e[2])
+            between.setdefault((e[1].id, e[0].id), e[2])
+
+        self._edges, self._between = edges, between
+        self._edges_dirty = False
+        logging.info("Rebuilt topology edge index, %s nodes with edges", len(edges))
+
+class TopologyIndexService(RuntimeService):
+    '''
+        Runtime service forwarding node and link changes to a TopologyIndex.
+    '''
+    def __init__(self, index):
+        super(TopologyIndexService, self).__init__()
+        self.index = index
+
+    @new_event(['nodes', 'links'])
+    def new(self, resource):
+        self._apply(resource)
+
+    @update_event(['nodes', 'links'])
+    def update(self, resource):
+        self._apply(resource)
+
+    @delete_event(['nodes', 'links'])
+    def delete(self, resource):
+        if isinstance(resource, Node):
+            self.index.remove_node(resource)
+        else:
+            self.index.remove_link(resource)
+        self._notify(resource)
+
+    def _apply(self, resource):
+        if isinstance(resource, Node):
+            self.index.add_node(resource)
+        else:
+            self.index.add_link(resource)
+        self._notify(resource)
+
+    def _notify(self, resource):
+        for listener in self.index.listeners:
+            listener(resource)
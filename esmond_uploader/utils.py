@@ -1,8 +1,14 @@
 import logging
+import threading
 from unis import Runtime
 from unis.models import Metadata, Link
+from topology import TopologyIndex, TopologyIndexService
 
 class UnisUtil:
+    '''
+        Topology helpers for uploading test results. Loading the topology is expensive, so tests should
+        use shared_util() to get the one instance per runtime rather than constructing their own.
+    '''
     def __init__(self, rt=None):
         self.rt = rt
         
@@ -11,6 +17,14 @@ class UnisUtil:
         self.rt.ports.load()
         self.rt.links.load()
 
+        self.index = TopologyIndex(self.rt)
+        self.rt.addService(TopologyIndexService(self.index))
+
+        self._subjects = {}
+        self._by_resource = {}
+        self._subject_lock = threading.RLock()
+        self.index.listeners.append(self.invalidate)
+
         logging.basicConfig(filename='logs/esmond_uploader.log',level=logging.DEBUG)
     '''
         NOTE: Ideally this function should just return 2 links. But because the nodes in the TechX demo 
@@ -19,18 +33,13 @@ class UnisUtil:
     '''
     def get_links(self, src_ip, dst_ip):
         
-        try:
-            src_node = next(self.rt.nodes.where(lambda n: n.properties.mgmtaddr == src_ip))
-            dst_node = next(self.rt.nodes.where(lambda n: n.properties.mgmtaddr == dst_ip))
-        except:
+        src_node = self.index.node_by_addr(src_ip)
+        dst_node = self.index.node_by_addr(dst_ip)
+        if src_node is None or dst_node is None:
             print("Could not find nodes. get_links( "  + src_ip + ", " + dst_ip + ")")
             return None, None
 
-        edges = []
-        for e in self.rt.graph.edges:
-            valid = any(n in e for n in [src_node,dst_node])
-            if valid:
-                edges.append(e)
+        edges = self.index.edges(src_node, dst_node)
             
         print("getting links")         
         switch_names = []
@@ -39,21 +48,12 @@ class UnisUtil:
                 switch_names.append(e[0].name)
         print("sw names", switch_names)
         try:
-            sw0 = next(self.rt.nodes.where(lambda n: n.name == switch_names[0]))
-            sw1 = next(self.rt.nodes.where(lambda n: n.name == switch_names[1]))
+            sw0 = self.index.node_by_name(switch_names[0])
+            sw1 = self.index.node_by_name(switch_names[1])
             print(sw0.name, sw1.name)
-            for e in self.rt.graph.edges:
-                if e[0].name == sw0.name and e[1].name == sw1.name:
-                    edges.append(e)
-                    print(e[0].name, e[1].name)
-                    return [e[2]]
-                    break
-                elif e[1].name == sw0.name and e[0].name == sw1.name:
-                    
-                    print(e[0].name, e[1].name)
-                    edges.append(e)
-                    return [e[2]]
-                    break
+            link = self.index.link_between(sw0, sw1)
+            if link is not None:
+                return [link]
         except:
             print("Could not find intermediate link")
             return [edges[0][2], edges[1][2]]
@@ -65,35 +65,96 @@ class UnisUtil:
 
     def check_create_virtual_link(self, src_ip, dst_ip):
         print("Checking for virtual link between " + src_ip + " and " + dst_ip)
-        try:
-            src_node = next(self.rt.nodes.where(lambda n: n.properties.mgmtaddr == src_ip))
-            dst_node = next(self.rt.nodes.where(lambda n: n.properties.mgmtaddr == dst_ip))
-        
-        except Exception as e:
-            print(e)
+        src_node = self.index.node_by_addr(src_ip)
+        dst_node = self.index.node_by_addr(dst_ip)
+        if src_node is None or dst_node is None:
             print("Could not find nodes. get_links( "  + src_ip + ", " + dst_ip + ")")
             return None, None
          
         print("found nodes - src: ", src_node,", dst:", dst_node)
 
         link_name = "virtual:" + src_node.name + ":" + dst_node.name
-        link = self.rt.links.first_where({"name": link_name})
+        link = self.index.link_by_name(link_name)
         
         if link is None:
             print("Creating new virtual link between ", src_node.name, " and ", dst_node.name)
             link = Link({"name": link_name, "properties":{"type":"virtual"}, "directed": False, "endpoints":[src_node.ports[0], dst_node.ports[0]]})
             self.rt.insert(link, commit=True)
+            self.index.add_link(link)
         
         return link
 
 
     def check_create_metadata(self, subject, **kwargs):
         
-        event_type = kwargs['event']
+        meta = self._find_create_metadata(subject, kwargs['event'], kwargs['src'], kwargs['dst'])
+        self._set_parameters(meta, kwargs['src'], kwargs['dst'], kwargs['archive'][0]['url'])
+        print("Returning metadata")         
+        return meta.data
+
+    def resolve_metadata(self, src_ip, dst_ip, event_type, archive_url):
+        '''
+            The Metadata for @event_type on the virtual link between @src_ip and @dst_ip.
+
+            Resolved (link, metadata) pairs are memoized per (src_ip, dst_ip, event_type) and dropped
+            when a change to one of their nodes or their link means they would resolve differently,
+            see invalidate. Metadata parameters are only rewritten and flushed when they
+            differ, so steady-state uploads cost no UNIS round-trips here.
+            returns - Metadata, or None if the nodes could not be found.
+        '''
+        key = (src_ip, dst_ip, event_type)
+        resolved = self._subjects.get(key)
+
+        if resolved is None:
+            with self._subject_lock:
+                resolved = self._subjects.get(key)
+                if resolved is None:
+                    link = self.check_create_virtual_link(src_ip, dst_ip)
+                    if not isinstance(link, Link):
+                        return None
+                    meta = self._find_create_metadata(link, event_type, src_ip, dst_ip)
+                    resolved = self._subjects[key] = (link, meta, self.index.node_by_addr(src_ip), self.index.node_by_addr(dst_ip))
+                    for resource in (link,) + resolved[2:]:
+                        self._by_resource.setdefault(resource.id, set()).add(key)
+
+        meta = resolved[1]
+        self._set_parameters(meta, src_ip, dst_ip, archive_url)
+        return meta
+
+    def invalidate(self, resource=None):
+        '''
+            Drop the memoized subjects that changed node or link @resource affects, or all of them when
+            @resource is None. A subject is kept while its addresses still map to the same nodes and its
+            link is still indexed, so updates that do not move anything (including the event for a
+            virtual link this util inserted itself) cost nothing. See resolve_metadata.
+        '''
+        with self._subject_lock:
+            if resource is None:
+                self._subjects, self._by_resource = {}, {}
+                return
+            for key in list(self._by_resource.get(getattr(resource, 'id', None), ())):
+                if not self._current(key, self._subjects[key]):
+                    self._forget(key)
+
+    def _current(self, key, resolved):
+        link, meta, src_node, dst_node = resolved
+        return self.index.node_by_addr(key[0]) is src_node and self.index.node_by_addr(key[1]) is dst_node \
+               and self.index.link_by_name(link.name) is link
+
+    def _forget(self, key):
+        resolved = self._subjects.pop(key)
+        for resource in (resolved[0],) + resolved[2:]:
+            keys = self._by_resource.get(resource.id)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_resource[resource.id]
+
+    def _find_create_metadata(self, subject, event_type, src, dst):
         print("looking for event type", event_type, "for subject :", subject.selfRef)
         try:
             meta = next(self.rt.metadata.where({"subject": subject, "eventType": event_type}))
-            if meta.parameters.source == kwargs['src'] and meta.parameters.destination == kwargs['dst']: 
+            if meta.parameters.source == src and meta.parameters.destination == dst: 
                 print("FOUND METADATA", meta.selfRef)            
             else:
                 raise Exception("Could not find metadata")
@@ -105,15 +166,43 @@ class UnisUtil:
             meta = self.rt.insert(Metadata({"eventType": event_type, "subject": subject, "parameters": {"source":"", "destination":"", "archive":""}}), commit=True)
             print(meta)
             logging.info("Creating metadata obj - %s ", meta.selfRef)
-        
-        meta.parameters.source = kwargs['src']
-        meta.parameters.destination = kwargs['dst']
-        meta.parameters.archive = kwargs['archive'][0]['url']
+
+        return meta
+
+    def _set_parameters(self, meta, src, dst, archive_url):
+        params = meta.parameters
+        if params.source == src and params.destination == dst and params.archive == archive_url:
+            return
+
+        params.source = src
+        params.destination = dst
+        params.archive = archive_url
         self.rt.flush()
-        print("Returning metadata")         
-        return meta.data
 
 
+_shared      = {}
+_shared_lock = threading.Lock()
+
+def shared_util(rt):
+    '''
+        The process-wide UnisUtil for runtime @rt, created on first use.
+        The topology is loaded once; afterwards the runtime's change events keep it and its indexes current.
+    '''
+    with _shared_lock:
+        entry = _shared.get(id(rt))
+        if entry is None or entry[0] is not rt:
+            logging.info("Loading shared topology from UNIS")
+            entry = _shared[id(rt)] = (rt, UnisUtil(rt=rt))
+        return entry[1]
+
+def set_shared_util(rt, util):
+    '''
+        Makes @util the shared util for runtime @rt, eg. a resolver that needs no UNIS topology in benchmarks.
+        @util must provide resolve_metadata() and invalidate().
+    '''
+    with _shared_lock:
+        _shared[id(rt)] = (rt, util)
+
 if __name__ == "__main__":
     util = UnisUtil(rt=Runtime("http://iu-ps01.osris.org:8888"))
     links = util.check_create_virtual_link("192.168.10.202", "192.168.10.204")
@@ -0,0 +1,133 @@
+import glob
+import json
+import logging
+import os
+import threading
+'''
+    Persistent per-test high-water marks.
+
+    A mark is the timestamp of the newest Esmond point that has been ingested for a given
+    (event type, source, destination). Tests only request points newer than their mark, and the
+    marks are kept on disk so a restart resumes where it stopped. Advancing a mark only touches
+    memory; the marks are saved every few seconds and on stop(). Each process saves only its own
+    file; shard workers read the files of the other workers (@peers) when they take over pairs.
+'''
+
+class WatermarkStore:
+    '''
+        Thread-safe mapping of test key -> last ingested timestamp, saved as JSON at @path.
+
+        param: interval - seconds between saves.
+        param: peers - glob pattern of the mark files of other processes, merged in on load and reload().
+    '''
+    def __init__(self, path, interval=10, peers=None):
+        self.path       = path
+        self.interval   = interval
+        self.peers      = peers
+        self.marks      = {}
+        self.dirty      = False
+        self._lock      = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._stopped   = threading.Event()
+        self._thread    = None
+
+        self._merge(self._read(self.path))
+        self._merge(self._read_peers())
+
+        return
+
+    @staticmethod
+    def key(event_type, src, dst):
+        return "|".join([event_type, src, dst])
+
+    def get(self, key):
+        with self._lock:
+            return self.marks.get(key)
+
+    def set(self, key, ts):
+        '''
+            Advance the mark for @key to @ts. Marks never move backwards.
+        '''
+        with self._lock:
+            if key in self.marks and self.marks[key] >= ts:
+                return
+            self.marks[key] = ts
+            self.dirty = True
+
+    def flush(self):
+        '''
+            Saves the marks if any advanced since the last save.
+        '''
+        with self._save_lock:
+            with self._lock:
+                if not self.dirty:
+                    return
+                self.dirty = False
+            try:
+                self._save()
+            except OSError as e:
+                logging.info("Could not save high-water marks to %s | %s", self.path, e)
+                with self._lock:
+                    self.dirty = True
+
+    def start(self):
+        '''
+            Saves the marks every @interval seconds from a background thread.
+        '''
+        self._thread = threading.Thread(target=self._flush_loop, name="watermarks", daemon=True)
+        self._thread.start()
+
+        return
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+    def reload(self):
+        '''
+            Take in marks saved by other processes since this store was loaded.
+        '''
+        marks = self._read_peers()
+        with self._lock:
+            self._merge(marks)
+
+    def _read_peers(self):
+        marks = {}
+        for path in sorted(glob.glob(self.peers)) if self.peers else []:
+            for key, ts in self._read(path).items():
+                if key not in marks or marks[key] < ts:
+                    marks[key] = ts
+        return marks
+
+    def _read(self, path):
+        if not os.path.exists(path):
+            return {}
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logging.info("Could not read high-water marks from %s | %s", path, e)
+            return {}
+
+    def _merge(self, marks):
+        for key, ts in marks.items():
+            if key not in self.marks or self.marks[key] < ts:
+                self.marks[key] = ts
+
+    def _save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with self._lock:
+            marks = dict(self.marks)
+        tmp = "%s.%d.tmp" % (self.path, os.getpid())
+        with open(tmp, "w") as f:
+            json.dump(marks, f)
+        os.replace(tmp, self.path)
+
+    def _flush_loop(self):
+        while not self._stopped.wait(self.interval):
+            self.flush()
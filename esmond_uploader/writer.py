@@ -0,0 +1,225 @@
+import glob
+import json
+import logging
+import os
+import threading
+import time
+
+import requests
+
+from sessions import get_session, deadline
+'''
+    Write-behind buffer for measurements headed to UNIS.
+
+    Tests hand their points to a shared MeasurementWriter instead of appending to each metadata's
+    data collection one value at a time. The writer groups the points per metadata id and posts them
+    to UNIS's /data endpoint in bulk when enough points are buffered or enough time has passed.
+    Points are buffered as timestamp/value columns and only become JSON objects when they are posted
+    or spilled.
+'''
+
+HEADERS = { "Content-Type": "application/perfsonar+json profile=http://unis.crest.iu.edu/schema/20160630/datum#",
+            "Accept": "*/*" }
+
+class MeasurementWriter:
+    '''
+        param: unis - the UNIS url, points are posted to <unis>/data.
+        param: max_points - flush as soon as this many points are buffered.
+        param: max_delay - flush buffered points at least every @max_delay seconds.
+        param: max_pending - writers block once this many points are waiting to be sent.
+        param: block_timeout - seconds a blocked writer waits before its points are spilled to disk.
+               A single post to UNIS is also given at most this long.
+        param: spill_dir - directory for points that could not be buffered or sent. Spilled points are
+               replayed after the next successful flush.
+    '''
+    def __init__(self, unis, max_points=5000, max_delay=5, max_pending=50000, block_timeout=30, spill_dir="state/spill"):
+        self.url            = unis.rstrip("/") + "/data"
+        self.max_points     = max_points
+        self.max_delay      = max_delay
+        self.max_pending    = max_pending
+        self.block_timeout  = block_timeout
+        self.spill_dir      = spill_dir
+        self.posts          = 0
+        self.points         = 0
+        self.spilled        = 0
+        self._buffer        = {}
+        self._callbacks     = []
+        self._buffered      = 0
+        self._inflight      = 0
+        self._cond          = threading.Condition()
+        self._flush_lock    = threading.Lock()
+        self._thread        = None
+        self._stopped       = False
+
+        return
+
+    def write(self, mid, value, ts):
+        self.write_many(mid, [{"ts": ts, "value": value}])
+
+    def write_columns(self, mid, ts, values):
+        '''
+            Buffer a batch of points for metadata @mid given as timestamp and value arrays, or lists.
+            The arrays are kept as they are until they are posted, so they must not be changed afterwards.
+            Blocks while the writer is over @max_pending and spills the points if that lasts longer
+            than @block_timeout.
+        '''
+        if len(ts) == 0:
+            return
+
+        deadline = time.time() + self.block_timeout
+        with self._cond:
+            while self._buffered + self._inflight + len(ts) > self.max_pending and self._buffered + self._inflight > 0:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            else:
+                self._buffer.setdefault(mid, []).append((ts, values))
+                self._buffered += len(ts)
+                if self._buffered >= self.max_points:
+                    self._cond.notify_all()
+                return
+
+        logging.info("UNIS writer is backed up, spilling %s points for %s", len(ts), mid)
+        self._spill(_entries([(mid, ts, values)]))
+
+    def write_many(self, mid, points):
+        '''
+            Buffer @points, a list of {"ts": ..., "value": ...} dicts, for metadata @mid, see write_columns.
+        '''
+        self.write_columns(mid, [p["ts"] for p in points], [p["value"] for p in points])
+
+    def when_sent(self, func):
+        '''
+            Calls @func, on the flushing thread, once every point written before this call has been posted
+            to UNIS or spilled to disk. Used to move high-water marks only past points that cannot be lost.
+        '''
+        with self._cond:
+            self._callbacks.append(func)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._flush_loop, name="unis-writer", daemon=True)
+        self._thread.start()
+
+        return
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+    def flush(self):
+        '''
+            Send everything buffered, grouped per metadata id, in posts of up to @max_points points.
+            returns - True if every post succeeded.
+        '''
+        with self._flush_lock:
+            with self._cond:
+                buffer, self._buffer = self._buffer, {}
+                callbacks, self._callbacks = self._callbacks, []
+                self._inflight, self._buffered = self._buffered, 0
+
+            ok = True
+            try:
+                for batch in self._batches(buffer):
+                    entries = _entries(batch)
+                    if not ok or not self._post(entries):
+                        ok = False
+                        self._spill(entries)
+            except Exception:
+                # some points were neither sent nor spilled, so no later callback may vouch for them
+                with self._cond:
+                    self._callbacks = []
+                raise
+            finally:
+                with self._cond:
+                    self._inflight = 0
+                    self._cond.notify_all()
+
+            for func in callbacks:
+                try:
+                    func()
+                except Exception:
+                    logging.exception("UNIS writer callback failed")
+
+            if ok:
+                self._replay()
+            return ok
+
+    def _batches(self, buffer):
+        '''
+            Yields lists of (mid, ts, values) column slices of about @max_points points.
+        '''
+        batch, size = [], 0
+        for mid, segments in buffer.items():
+            for ts, values in segments:
+                for i in range(0, len(ts), self.max_points):
+                    batch.append((mid, ts[i:i + self.max_points], values[i:i + self.max_points]))
+                    size += len(batch[-1][1])
+                    if size >= self.max_points:
+                        yield batch
+                        batch, size = [], 0
+        if batch:
+            yield batch
+
+    def _post(self, batch):
+        try:
+            with deadline(self.block_timeout):
+                response = get_session().post(self.url, data=json.dumps(batch), headers=HEADERS)
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            logging.info("Could not post %s measurement groups to UNIS | %s", len(batch), e)
+            return False
+
+        self.posts  += 1
+        self.points += sum(len(entry["data"]) for entry in batch)
+        return True
+
+    def _spill(self, batch):
+        os.makedirs(self.spill_dir, exist_ok=True)
+        path = os.path.join(self.spill_dir, "spill-%d-%d.jsonl" % (time.time() * 1000000, threading.get_ident()))
+        with open(path, "w") as f:
+            for entry in batch:
+                f.write(json.dumps(entry) + "\n")
+        self.spilled += sum(len(entry["data"]) for entry in batch)
+
+    def _replay(self):
+        for path in sorted(glob.glob(os.path.join(self.spill_dir, "spill-*.jsonl"))):
+            with open(path) as f:
+                batch = [json.loads(line) for line in f if line.strip()]
+            if batch and not self._post(batch):
+                return
+            os.remove(path)
+            logging.info("Replayed spilled measurements from %s", path)
+
+    def _flush_loop(self):
+        while True:
+            with self._cond:
+                deadline = time.time() + self.max_delay
+                while not self._stopped and self._buffered < self.max_points:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                if self._stopped:
+                    return
+
+            self.flush()
+
+def _entries(batch):
+    '''
+        The /data entries, {"mid": ..., "data": [{"ts": ..., "value": ...}, ...]}, for a list of
+        (mid, ts, values) columns. Consecutive columns of the same metadata share one entry.
+    '''
+    entries = []
+    for mid, ts, values in batch:
+        if not entries or entries[-1]["mid"] != mid:
+            entries.append({"mid": mid, "data": []})
+        entries[-1]["data"].extend({"ts": t, "value": v} for t, v in zip(_tolist(ts), _tolist(values)))
+    return entries
+
+def _tolist(column):
+    return column.tolist() if hasattr(column, "tolist") else column
@@ -19,9 +19,16 @@ mid = ''  # <---- Insert the MID provided by the noise script here
 #---------------------------------
 # Basic built-in data reading
 #---------------------------------
+import os
+import sys
+import threading
 from unis import Runtime
 from unis.measurements import Last
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from analysis.subscribe import subscribe
+
 def example1():
     rt = Runtime('http://localhost:8888')  # Create runtime
 
@@ -34,20 +41,18 @@ def example1():
     md.data.attachFunction(Last())  # Create a 'last' property for the data
                                     # which prints the last measurement
 
-    # print each new value
-    prev = md.data.last
-    while True:
-        new = md.data.last
-        if prev != new:
-            print(md.data.last)
-            prev = new
+    # print each new value as it arrives
+    subscribe(md, lambda value, ts: print(md.data.last))
+    threading.Event().wait()
 
 
 #---------------------------------
 # Creating a basic streaming function
 #---------------------------------
+import asyncio
 from unis import Runtime
 from unis.measurements import Function
+from analysis.subscribe import stream
 
 class MyFunction(Function):
     def apply(self, value, ts):
@@ -65,13 +70,12 @@ def example2():
     md.data.attachFunction(MyFunction(), 'half_sum')  # Create a 'half_sum'
                                                       # property for the data
 
-    # print each new value
-    prev = md.data.half_sum
-    while True:
-        new = md.data.half_sum
-        if prev != new:
+    # print each new value as it arrives
+    async def watch():
+        async for value, ts in stream(md):
             print(md.data.half_sum)
-            prev = new
+
+    asyncio.run(watch())
 
 
 #---------------------------------
@@ -108,3 +112,27 @@ class MyMean(Function):
 # md.data.attachFunction(MyMean(), 'mean')
 # print(md.data.mean)  # prints 3.3 when given [5, 1, 4]
 # print(md.data.mean)  # prints 8 when given [8, 9, 7]
+
+
+#---------------------------------
+# Streaming statistics
+#---------------------------------
+# The analysis package provides constant-memory aggregators that can be
+# attached to any number of metadata objects.
+from analysis.functions import EWMA, WindowedMean, Quantile, SlidingMax
+
+def example3():
+    rt = Runtime('http://localhost:8888')  # Create runtime
+
+    try:
+        md = next(rt.metadata.where({'id': mid})) # Get the metadata object
+    except StopIteration:
+        print("No metadata by that ID")
+        return
+
+    md.data.attachFunction(EWMA(alpha=0.2), 'ewma')
+    md.data.attachFunction(WindowedMean(60), 'mean_60')
+    md.data.attachFunction(Quantile([0.5, 0.99]), 'quantiles')
+    md.data.attachFunction(SlidingMax(60), 'max_60')
+
+    print(md.data.ewma, md.data.mean_60, md.data.quantiles, md.data.max_60)
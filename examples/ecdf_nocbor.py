@@ -1,42 +1,28 @@
-import math
-import matplotlib
-matplotlib.use('Agg');
-import matplotlib.pyplot as plt
-from statsmodels.distributions.empirical_distribution import ECDF
-import cbor2
+import os
+import sys
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from analysis.ecdf import StreamingECDF, read_text, render
+from analysis.series import SeriesReader
+
+# Plots the CDF of the last 100 values of a "ts value" text file, or of a
+# .series file (see analysis/series.py), after every 100 values, writing
+# ecdf_<n>.png files.
+#
+# python ecdf_nocbor.py [window] [step]
 
 def main():
    
     inputf = input("Input file: ")
-    with open(inputf, "r") as input1:
-         i = 0;
-         ic = 0;
-         line0 = input1.readline().strip();
-         numd = 1.0;
-         data = [0.0] * 100;
-         while (line0 != ""):
-             sl = line0.split(" ");
-             ts = int(sl[0]);
-             val = float(sl[1]);
-             data[i] = val;
-             i = int(math.fmod(i + 1, 100));
-             if (math.fmod(numd, 100) == 0.0):
-                cdf = ECDF(data);
-                plt.plot(cdf.x, cdf.y, label="statmodels", 
-                     marker="<", markerfacecolor='none');
-                plt.legend();
-                plt.title("CDF as a function of Data");
-                plt.xlabel("data");
-                plt.ylabel("cdf");
-                ics = str(ic);
-                plt.savefig("ecdf_" + ics + ".png");
-                plt.close();
-                ic = ic + 1;
-             line0 = input1.readline().strip();
-            
-             numd = numd + 1;
-                            
+    window = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    step   = int(sys.argv[2]) if len(sys.argv) > 2 else window
+
+    ecdf = StreamingECDF(window=window, step=step)
+    ic = 0
+    chunks = SeriesReader(inputf).chunks() if inputf.endswith(".series") else read_text(inputf)
+    for ts, values in chunks:
+        ic = render(ecdf.update(values), prefix="ecdf_", start=ic)
 
 
 main()
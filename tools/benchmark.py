@@ -0,0 +1,363 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from urllib.request import urlopen
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "esmond_uploader"))
+
+import sessions
+import metadata_cache
+from discovery import MeshDiscovery
+from esmond_test import ThroughputTest, HistogramOWDelayTest
+from esmond_async import AsyncArchiveClient, ASYNC_TESTS
+from series_cache import SeriesCache
+from utils import set_shared_util
+from watermarks import WatermarkStore
+from writer import MeasurementWriter
+from fake_servers import FakeEsmond, FakeUnis, RemoteFake
+'''
+    End-to-end benchmark of the uploader against the fake Esmond and UNIS servers.
+
+    A scenario describes a mesh; every sampled (test, source, destination) pair is polled once per
+    cycle the way the daemon polls it, through the real sessions, metadata cache, discovery, tests
+    and writer. The archive's newest results are hidden at the start, the first cycle starts cold
+    (tests are built and load their initial time range), and before every later cycle one test
+    interval of hidden results is published, so each cycle fetches and uploads one interval of new
+    results, as the daemon does in steady state. The archive's clock ends at wall time rather than
+    running ahead of it.
+
+    Reported per scenario, for the cold cycle and for the steady cycles: pairs and points per
+    second, per-pair p50/p99 poll latency, p99 cycle time, requests seen by each server and the
+    peak resident memory of the process. With the default in-process servers the memory figure
+    includes the servers; start them with fake_servers.py and pass --esmond/--unis to leave them out.
+
+    Metadata is resolved in memory instead of through a UNIS topology, see MemoryUtil.
+
+        python tools/benchmark.py mesh-10 mesh-100 --json results.json
+        python tools/benchmark.py mesh-100 --baseline results.json
+'''
+
+SCENARIOS = { "mesh-10":   {"hosts": 10,   "max_pairs": None, "discovery": "source"},
+              "mesh-100":  {"hosts": 100,  "max_pairs": 2000, "discovery": "source"},
+              "mesh-300":  {"hosts": 300,  "max_pairs": 3000, "discovery": "source"},
+              "mesh-1000": {"hosts": 1000, "max_pairs": 5000, "discovery": "off"} }
+
+TESTS = { "throughput": ThroughputTest,
+          "latency":    HistogramOWDelayTest }
+
+class MemoryUtil:
+    '''
+        Stand-in for UnisUtil that gives every (source, destination, event type) a stable metadata id
+        without loading a topology.
+    '''
+    def __init__(self):
+        self.resolved   = {}
+        self._lock      = threading.Lock()
+
+        return
+
+    def resolve_metadata(self, src_ip, dst_ip, event_type, archive_url):
+        key = (src_ip, dst_ip, event_type)
+        with self._lock:
+            meta = self.resolved.get(key)
+            if meta is None:
+                meta = self.resolved[key] = SimpleNamespace(id=uuid.uuid5(uuid.NAMESPACE_URL, "|".join(key)).hex)
+        return meta
+
+    def invalidate(self, *args):
+        self.resolved = {}
+
+class Benchmark:
+    '''
+        param: name, scenario - a name and entry of SCENARIOS.
+        param: esmond, unis - running fake servers (FakeEsmond/FakeUnis or RemoteFake).
+        param: workers - polling threads, or requests per host in async mode.
+        param: cycles - polling cycles including the cold one.
+        param: step - seconds of new results published between cycles.
+    '''
+    def __init__(self, name, scenario, esmond, unis, workers=16, cycles=5, step=120, async_mode=False,
+                 series_cache_mb=0, seed=1):
+        self.name       = name
+        self.scenario   = scenario
+        self.esmond     = esmond
+        self.unis       = unis
+        self.workers    = workers
+        self.cycles     = cycles
+        self.step       = step
+        self.async_mode = async_mode
+        self.state_dir  = tempfile.mkdtemp(prefix="esmond-bench-")
+        self.writer     = MeasurementWriter(unis.url, spill_dir=os.path.join(self.state_dir, "spill"))
+        self.options    = {"runtime": None, "writer": self.writer,
+                           "watermarks": WatermarkStore(os.path.join(self.state_dir, "watermarks.json")),
+                           # results are published up to @cycles steps late, see run()
+                           "series_cache": SeriesCache(os.path.join(self.state_dir, "series"),
+                                                       max_bytes=int(series_cache_mb * 1024 * 1024),
+                                                       settle=step * cycles + 300)
+                                           if series_cache_mb > 0 else None}
+        self.tests      = {}
+        self.failed     = 0
+        self._lock      = threading.Lock()
+        self.random     = random.Random(seed)
+
+        with urlopen(esmond.url + "/mesh") as response:
+            self.mesh   = json.loads(response.read())
+        self.pairs      = self._sample(scenario.get("max_pairs"))
+
+        return
+
+    def _sample(self, max_pairs):
+        pairs = [(job["description"], src, dst) for job in self.mesh["tests"] if job["description"] in TESTS
+                 for src in job["members"]["members"] for dst in job["members"]["members"] if src != dst]
+        if max_pairs and len(pairs) > max_pairs:
+            pairs = sorted(self.random.sample(pairs, max_pairs))
+        return pairs
+
+    def run(self):
+        '''
+            returns - the results as a dict, see report().
+        '''
+        set_shared_util(None, MemoryUtil())
+        sessions.configure(pool_size=self.workers, timeout=(5, 60), rate=0)
+        metadata_cache.configure(ttl=300)
+        self.writer.start()
+        self.esmond.advance(-self.step * (self.cycles - 1))
+
+        began = self.esmond.stats(), self.unis.stats()
+        try:
+            if self.async_mode:
+                cycles = asyncio.run(self._run_async())
+            else:
+                with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                    cycles = [self._cycle(i, lambda: list(pool.map(self._poll, self.pairs)))
+                              for i in range(self.cycles)]
+        finally:
+            self.writer.stop()
+            shutil.rmtree(self.state_dir, ignore_errors=True)
+        ended = self.esmond.stats(), self.unis.stats()
+
+        return {"scenario": self.name, "hosts": len(self.mesh["tests"][0]["members"]["members"]),
+                "pairs": len(self.pairs), "workers": self.workers, "mode": "async" if self.async_mode else "threads",
+                "cycles": len(cycles), "failed": self.failed,
+                "cold": _summarize(cycles[:1]), "steady": _summarize(cycles[1:]),
+                "requests": {"esmond": _diff(began[0]["counts"], ended[0]["counts"]),
+                             "unis": _diff(began[1]["counts"], ended[1]["counts"]),
+                             "connections": sessions.get_session().stats()["connections"]},
+                "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1)}
+
+    def _cycle(self, index, poll_all):
+        '''
+            One polling cycle: publishes new results, repeats discovery and polls every pair.
+        '''
+        if index:
+            self.esmond.advance(self.step)
+            self._expire_listings()
+        points = self.unis.stats()["points"]
+        began = time.time()
+
+        self._discover()
+        latencies = poll_all()
+        self.writer.flush()
+
+        return {"seconds": time.time() - began, "latencies": latencies,
+                "points": self.unis.stats()["points"] - points}
+
+    def _discover(self):
+        if self.scenario.get("discovery", "off") == "off":
+            return
+        for job in self.mesh["tests"]:
+            if job["description"] not in TESTS:
+                continue
+            discovery = MeshDiscovery(self.esmond.url, mode=self.scenario["discovery"])
+            try:
+                discovery.prime(TESTS[job["description"]].event_type, job["members"]["members"])
+            except Exception as e:
+                logging.info("Mesh discovery failed for %s, falling back to per pair listings | %s", job["description"], e)
+
+    def _expire_listings(self):
+        '''
+            Per pair listings are as old after a cycle as after a test interval in the daemon, so they
+            are revalidated at their next use.
+        '''
+        cache = metadata_cache.get_cache()
+        with cache._lock:
+            for listing in cache._listings.values():
+                listing.fetched = 0
+
+    def _poll(self, key):
+        began = time.time()
+        try:
+            test = self.tests.get(key)
+            if test is None:
+                test = self.tests[key] = TESTS[key[0]](self.esmond.url, source=key[1], destination=key[2], **self.options)
+            with sessions.deadline(120):
+                if test.fetch(time_range=3600, upload=True) is None:
+                    raise ValueError("no archive entries")
+        except Exception as e:
+            logging.info("Poll failed for %s | %s", key, e)
+            with self._lock:
+                self.failed += 1
+        return time.time() - began
+
+    async def _run_async(self):
+        client = AsyncArchiveClient(per_host=self.workers)
+        loop = asyncio.get_event_loop()
+        cycles = []
+        try:
+            for i in range(self.cycles):
+                if i:
+                    await loop.run_in_executor(None, self.esmond.advance, self.step)
+                    self._expire_listings()
+                points = self.unis.stats()["points"]
+                began = time.time()
+
+                await loop.run_in_executor(None, self._discover)
+                latencies = await asyncio.gather(*[self._poll_async(key, client) for key in self.pairs])
+                await loop.run_in_executor(None, self.writer.flush)
+
+                cycles.append({"seconds": time.time() - began, "latencies": latencies,
+                               "points": self.unis.stats()["points"] - points})
+        finally:
+            await client.close()
+        return cycles
+
+    async def _poll_async(self, key, client):
+        began = time.time()
+        try:
+            test = self.tests.get(key)
+            if test is None:
+                test_class = ASYNC_TESTS[TESTS[key[0]]]
+                test = self.tests[key] = await asyncio.get_event_loop().run_in_executor(
+                    None, lambda: test_class(self.esmond.url, key[1], key[2], client, **self.options))
+            if await test.fetch(time_range=3600, upload=True) is None:
+                raise ValueError("no archive entries")
+        except Exception as e:
+            logging.info("Poll failed for %s | %s", key, e)
+            self.failed += 1
+        return time.time() - began
+
+def _summarize(cycles):
+    if not cycles:
+        return None
+    seconds = sum(c["seconds"] for c in cycles)
+    latencies = sorted(l for c in cycles for l in c["latencies"])
+    return {"seconds": round(seconds, 3),
+            "pairs_per_sec": round(len(latencies) / seconds, 1),
+            "points_per_sec": round(sum(c["points"] for c in cycles) / seconds, 1),
+            "p50_ms": round(_percentile(latencies, 50) * 1000, 1),
+            "p99_ms": round(_percentile(latencies, 99) * 1000, 1),
+            "cycle_p99_s": round(_percentile(sorted(c["seconds"] for c in cycles), 99), 3)}
+
+def _percentile(values, q):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * q / 100.0))]
+
+def _diff(before, after):
+    return {k: after[k] - before.get(k, 0) for k in sorted(after) if after[k] != before.get(k, 0)}
+
+def report(result):
+    print("%s: %s pairs on %s hosts, %s %s, %s cycles, %s failed polls" % (result["scenario"], result["pairs"],
+          result["hosts"], result["workers"], result["mode"], result["cycles"], result["failed"]))
+    for phase in ("cold", "steady"):
+        r = result[phase]
+        if r is None:
+            continue
+        print("  %-7s %8.2fs %9.1f pairs/s %11.1f points/s   p50 %7.1fms   p99 %7.1fms   cycle p99 %.2fs" % (
+              phase, r["seconds"], r["pairs_per_sec"], r["points_per_sec"], r["p50_ms"], r["p99_ms"], r["cycle_p99_s"]))
+    requests = result["requests"]
+    print("  esmond  %s" % ", ".join("%s %s" % item for item in requests["esmond"].items()))
+    print("  unis    %s" % ", ".join("%s %s" % item for item in requests["unis"].items()))
+    print("  client  %s connections, max rss %.1f MB" % (requests["connections"], result["max_rss_mb"]))
+
+def compare(results, baseline, tolerance):
+    '''
+        Steady state throughput that dropped, or p99 latency that rose, by more than @tolerance
+        against the results in @baseline.
+        returns - a list of regression descriptions.
+    '''
+    previous = {r["scenario"]: r for r in baseline}
+    regressions = []
+    for result in results:
+        old = previous.get(result["scenario"], {}).get("steady")
+        new = result["steady"]
+        if old is None or new is None:
+            continue
+        for metric in ("pairs_per_sec", "points_per_sec"):
+            if new[metric] < old[metric] * (1 - tolerance):
+                regressions.append("%s %s %s -> %s" % (result["scenario"], metric, old[metric], new[metric]))
+        if new["p99_ms"] > old["p99_ms"] * (1 + tolerance):
+            regressions.append("%s p99_ms %s -> %s" % (result["scenario"], old["p99_ms"], new["p99_ms"]))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the uploader against fake Esmond and UNIS servers.")
+    parser.add_argument("scenarios", nargs="*", default=["mesh-10", "mesh-100"],
+                        help="scenarios to run, from: " + ", ".join(SCENARIOS))
+    parser.add_argument("--workers", type=int, default=16, help="polling threads, or requests per host with --async")
+    parser.add_argument("--cycles", type=int, default=5, help="polling cycles, the first one cold")
+    parser.add_argument("--step", type=int, default=120, help="seconds of new results per cycle")
+    parser.add_argument("--cadence", type=int, default=60, help="seconds between results in the fake archive")
+    parser.add_argument("--max-pairs", type=int, help="override the scenario's pair sample size")
+    parser.add_argument("--async", dest="async_mode", action="store_true", help="poll on one event loop")
+    parser.add_argument("--series-cache-mb", type=float, default=0, help="enable the on-disk series cache")
+    parser.add_argument("--delay", type=float, default=0, help="seconds added to every archive response")
+    parser.add_argument("--fail-rate", type=float, default=0, help="fraction of archive requests failed with a 503")
+    parser.add_argument("--esmond", help="url of an external fake Esmond, see fake_servers.py")
+    parser.add_argument("--unis", help="url of an external fake UNIS, see fake_servers.py")
+    parser.add_argument("--seed", type=int, default=1, help="seed for sampling pairs")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="results of an earlier run to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative change against --baseline")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error("unknown scenario " + ", ".join(unknown))
+
+    results = []
+    for name in args.scenarios:
+        scenario = dict(SCENARIOS[name])
+        if args.max_pairs:
+            scenario["max_pairs"] = args.max_pairs
+        if args.esmond:
+            esmond = RemoteFake(args.esmond)
+        else:
+            esmond = FakeEsmond(hosts=scenario["hosts"], cadence=args.cadence, delay=args.delay,
+                                fail_rate=args.fail_rate).start()
+        unis = RemoteFake(args.unis) if args.unis else FakeUnis().start()
+        try:
+            result = Benchmark(name, scenario, esmond, unis, workers=args.workers, cycles=args.cycles, step=args.step,
+                               async_mode=args.async_mode, series_cache_mb=args.series_cache_mb, seed=args.seed).run()
+        finally:
+            esmond.stop()
+            unis.stop()
+        report(result)
+        results.append(result)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print("REGRESSION " + regression)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,320 @@
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+from urllib.request import Request, urlopen
+'''
+    In-process stand-ins for an Esmond archive and a UNIS instance, for benchmarking the uploader
+    without live services.
+
+    FakeEsmond serves archive listings, raw and summary data series and a mesh config for a
+    synthetic full mesh; series are generated on request, so any history length costs no memory.
+    FakeUnis accepts everything and counts the measurement points posted to /data. Both count
+    requests per kind and can add latency or fail a fraction of requests.
+
+        esmond = FakeEsmond(hosts=100, cadence=60).start()
+        unis   = FakeUnis().start()
+        ...
+        esmond.stop(); unis.stop()
+
+    Run as a script to serve both from a separate process; GET /_stats and POST /_advance?seconds=N
+    then stand in for stats() and advance(), see RemoteFake.
+'''
+
+ARCHIVE = "/esmond/perfsonar/archive/"
+
+TESTS = { "throughput": ("throughput",),
+          "latency":    ("histogram-owdelay", "packet-count-lost") }
+
+SUMMARIES = { "throughput":         [("average", 86400)],
+              "histogram-owdelay":  [("aggregation", 3600), ("aggregation", 86400), ("statistics", 0)],
+              "packet-count-lost":  [("aggregation", 300), ("aggregation", 3600), ("aggregation", 86400)] }
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.fake.handle(self, "GET")
+
+    def do_POST(self):
+        self.server.fake.handle(self, "POST")
+
+    def do_PUT(self):
+        self.server.fake.handle(self, "PUT")
+
+    def log_message(self, *args):
+        pass
+
+class _FakeServer:
+    '''
+        param: delay - seconds added to every response.
+        param: fail_rate - fraction of requests answered with a 503. The mesh config and the control
+               routes (/_stats, /_advance) never fail.
+        param: port - port to listen on, 0 for any free port.
+    '''
+    def __init__(self, delay=0, fail_rate=0, port=0):
+        self.delay      = delay
+        self.fail_rate  = fail_rate
+        self.counts     = Counter()
+        self.bytes      = 0
+        self._lock      = threading.Lock()
+        self._server    = ThreadingHTTPServer(("127.0.0.1", port), _Handler)
+        self._server.daemon_threads = True
+        self._server.fake = self
+        self._thread    = None
+        self.url        = "http://127.0.0.1:%d" % self._server.server_address[1]
+
+        return
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name=type(self).__name__, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def stats(self):
+        with self._lock:
+            return {"counts": dict(self.counts), "bytes": self.bytes}
+
+    def advance(self, seconds):
+        pass
+
+    def count(self, kind, n=1):
+        with self._lock:
+            self.counts[kind] += n
+
+    def handle(self, request, method):
+        url = urlsplit(request.path)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        if url.path == "/_stats":
+            return self.respond(request, 200, self.stats())
+        if url.path == "/_advance":
+            self.advance(int(query.get("seconds") or 0))
+            return self.respond(request, 200, self.stats())
+
+        length = int(request.headers.get("Content-Length") or 0)
+        body = request.rfile.read(length) if length else b""
+        if self.delay:
+            time.sleep(self.delay)
+        if self.fail_rate and url.path != "/mesh" and random.random() < self.fail_rate:
+            self.count("failed")
+            return self.respond(request, 503, {"error": "unavailable"})
+
+        status, payload, headers = self.route(method, url.path, query, body, request.headers)
+        self.respond(request, status, payload, headers)
+
+    def respond(self, request, status, payload, headers=None):
+        data = json.dumps(payload).encode() if payload is not None else b""
+        request.send_response(status)
+        request.send_header("Content-Type", "application/json")
+        request.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            request.send_header(key, value)
+        request.end_headers()
+        request.wfile.write(data)
+        with self._lock:
+            self.bytes += len(data)
+
+class FakeEsmond(_FakeServer):
+    '''
+        A full mesh of @hosts hosts running every test in @tests.
+
+        param: cadence - seconds between results of every test.
+        param: history - seconds of results kept by the archive.
+        param: buckets - number of buckets in each one-way delay histogram.
+        param: interval - test interval published in the mesh config.
+    '''
+    def __init__(self, hosts=10, tests=("throughput", "latency"), cadence=60, history=7 * 86400, buckets=20,
+                 interval=120, **kwargs):
+        _FakeServer.__init__(self, **kwargs)
+        self.hosts      = ["10.%d.%d.1" % (i // 250, i % 250) for i in range(hosts)]
+        self.members    = set(self.hosts)
+        self.tests      = tests
+        self.cadence    = cadence
+        self.history    = history
+        self.buckets    = buckets
+        self.interval   = interval
+        self.offset     = 0
+
+        return
+
+    def now(self):
+        return int(time.time()) + self.offset
+
+    def advance(self, seconds):
+        '''
+            Moves the archive's clock by @seconds. A negative value hides the newest results, and moving
+            forward again publishes them at once; the clock never runs ahead of wall time, so clients
+            comparing archive timestamps with their own clock see a consistent history.
+        '''
+        with self._lock:
+            self.offset = min(0, self.offset + seconds)
+
+    def stats(self):
+        stats = _FakeServer.stats(self)
+        stats["now"] = self.now()
+        return stats
+
+    def latest(self):
+        now = self.now()
+        return now - now % self.cadence
+
+    def mesh(self):
+        return {"tests": [{"description": test, "parameters": {"interval": self.interval},
+                           "members": {"members": list(self.hosts)}} for test in self.tests]}
+
+    def route(self, method, path, query, body, headers):
+        if path == "/mesh":
+            self.count("mesh")
+            return 200, self.mesh(), {}
+        if not path.startswith(ARCHIVE):
+            self.count("unknown")
+            return 404, {"error": "not found"}, {}
+
+        parts = [p for p in path[len(ARCHIVE):].split("/") if p]
+        if not parts:
+            etag = '"%d"' % self.latest()
+            if headers.get("If-None-Match") == etag:
+                self.count("not-modified")
+                return 304, None, {"ETag": etag}
+            self.count("listing")
+            return 200, self.listing(query), {"ETag": etag}
+        if len(parts) < 3:
+            self.count("unknown")
+            return 404, {"error": "not found"}, {}
+
+        key, event_type, kind = parts[0], parts[1], parts[2]
+        window = int(parts[3]) if len(parts) > 3 else 0
+        self.count("data" if kind == "base" else "summary")
+        return 200, self.series(key, event_type, window, query), {}
+
+    def listing(self, query):
+        event_type = query.get("event-type")
+        tests = [t for t in self.tests if event_type is None or event_type in TESTS[t]]
+        srcs = [query["source"]] if "source" in query else self.hosts
+        dsts = [query["destination"]] if "destination" in query else self.hosts
+
+        entries = [self.entry(test, src, dst) for test in tests for src in srcs for dst in dsts
+                   if src != dst and src in self.members and dst in self.members]
+        offset, limit = int(query.get("offset") or 0), query.get("limit")
+        return entries[offset:offset + int(limit)] if limit else entries[offset:]
+
+    def entry(self, test, src, dst):
+        key = _key(test, src, dst)
+        updated = self.latest()
+        events = []
+        for event_type in TESTS[test]:
+            base = "%s%s/%s/" % (ARCHIVE, key, event_type)
+            events.append({"event-type": event_type, "base-uri": base + "base", "time-updated": updated,
+                           "summaries": [{"summary-type": kind, "summary-window": str(window),
+                                          "uri": "%s%ss/%d" % (base, kind, window), "time-updated": updated}
+                                         for kind, window in SUMMARIES[event_type]]})
+        return {"metadata-key": key, "uri": ARCHIVE + key + "/", "url": self.url + ARCHIVE + key + "/",
+                "source": src, "destination": dst, "input-source": src, "input-destination": dst,
+                "tool-name": "bwctl/iperf3" if test == "throughput" else "powstream",
+                "event-types": events}
+
+    def series(self, key, event_type, window, query):
+        end = self.latest()
+        if "time-end" in query:
+            end = min(end, int(query["time-end"]))
+        if "time-start" in query:
+            start = int(query["time-start"])
+        else:
+            start = end - int(query.get("time-range") or 86400)
+        start = max(start, end - self.history)
+
+        step = max(window, self.cadence)
+        first = start + (-start) % step
+        return [self.point(key, event_type, ts) for ts in range(first, end + 1, step)]
+
+    def point(self, key, event_type, ts):
+        seed = int(hashlib.md5(("%s%s%d" % (key, event_type, ts)).encode()).hexdigest()[:8], 16)
+        if event_type == "throughput":
+            return {"ts": ts, "val": 9e8 + seed % 100000000}
+        if event_type == "packet-count-lost":
+            return {"ts": ts, "val": seed % 7}
+        low = 100 + seed % 50
+        return {"ts": ts, "val": {"%.1f" % ((low + b) / 10.0): 1 + (seed >> b) % 30 for b in range(self.buckets)}}
+
+class FakeUnis(_FakeServer):
+    '''
+        Accepts every request; GETs answer with an empty collection. Points posted to /data are counted
+        in @points.
+    '''
+    def __init__(self, **kwargs):
+        _FakeServer.__init__(self, **kwargs)
+        self.points = 0
+
+        return
+
+    def stats(self):
+        stats = _FakeServer.stats(self)
+        stats["points"] = self.points
+        return stats
+
+    def route(self, method, path, query, body, headers):
+        collection = path.strip("/").split("/")[0] or "about"
+        self.count("%s %s" % (method, collection))
+        if method == "GET":
+            return 200, [], {}
+
+        payload = json.loads(body) if body else None
+        if collection == "data" and isinstance(payload, list):
+            points = sum(len(entry.get("data", [])) for entry in payload)
+            with self._lock:
+                self.points += points
+        return 201 if method == "POST" else 200, payload, {}
+
+class RemoteFake:
+    '''
+        A fake server started as a script elsewhere, with the same stats() and advance() as the in-process ones.
+    '''
+    def __init__(self, url):
+        self.url = url.rstrip("/")
+
+        return
+
+    def stats(self):
+        with urlopen(self.url + "/_stats") as response:
+            return json.loads(response.read())
+
+    def advance(self, seconds):
+        with urlopen(Request("%s/_advance?seconds=%d" % (self.url, seconds), data=b"", method="POST")) as response:
+            response.read()
+
+    def stop(self):
+        pass
+
+def _key(test, src, dst):
+    return hashlib.md5(("%s|%s|%s" % (test, src, dst)).encode()).hexdigest()[:16]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a fake Esmond archive and a fake UNIS.")
+    parser.add_argument("--hosts", type=int, default=100, help="hosts in the mesh")
+    parser.add_argument("--cadence", type=int, default=60, help="seconds between results of every test")
+    parser.add_argument("--history", type=int, default=7 * 86400, help="seconds of results kept by the archive")
+    parser.add_argument("--esmond-port", type=int, default=8081)
+    parser.add_argument("--unis-port", type=int, default=8888)
+    parser.add_argument("--delay", type=float, default=0, help="seconds added to every archive response")
+    parser.add_argument("--fail-rate", type=float, default=0, help="fraction of archive requests failed with a 503")
+    args = parser.parse_args()
+
+    esmond = FakeEsmond(hosts=args.hosts, cadence=args.cadence, history=args.history, delay=args.delay,
+                        fail_rate=args.fail_rate, port=args.esmond_port).start()
+    unis = FakeUnis(port=args.unis_port).start()
+    print("Esmond at %s, mesh config at %s/mesh, UNIS at %s" % (esmond.url, esmond.url, unis.url))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        esmond.stop()
+        unis.stop()
@@ -6,11 +6,14 @@ import json
 
 from uuid import uuid4
 
+# One kept-alive session for every post to UNIS
+session = requests.Session()
+
 def create_node(url):
     url = "{}/nodes".format(url)
     nid = str(uuid4())
     data = { 'id': nid }
-    requests.post(url, data=json.dumps(data))
+    session.post(url, data=json.dumps(data))
     return nid
 
 def create_metadata(url, nid):
@@ -24,7 +27,7 @@ def create_metadata(url, nid):
         },
         'eventType': 'test'
     }
-    requests.post(url, data=json.dumps(data))
+    session.post(url, data=json.dumps(data))
     return mid
     
 def create_event(url, mid):
@@ -34,7 +37,7 @@ def create_event(url, mid):
              "ttl": 1500000 }
     headers= { "Content-Type": "application/perfsonar+json profile=http://unis.crest.iu.edu/schema/20160630/datum#",
                "Accept": "*/*" }
-    requests.post(url_to, data=json.dumps(data), headers=headers)
+    session.post(url_to, data=json.dumps(data), headers=headers)
     
 def create_data(url, mid):
     url = "{}/data/{}".format(url, mid)
@@ -42,7 +45,7 @@ def create_data(url, mid):
     headers= { "Content-Type": "application/perfsonar+json profile=http://unis.crest.iu.edu/schema/20160630/datum#",
                "Accept": "*/*" }
     print("--Posting", url, data)
-    requests.post(url, data=json.dumps(data), headers=headers)
+    session.post(url, data=json.dumps(data), headers=headers)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()